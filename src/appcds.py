@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Module to manage the class-data-sharing archive of the JVM running Guacamole."""
+
+import hashlib
+import logging
+import re
+from typing import Optional
+
+from ops.model import Container
+from ops.pebble import ExecError
+
+logger = logging.getLogger(__name__)
+
+APPCDS_DIR = "/var/lib/guacamole/appcds"
+# Time the JVM has to write the archive after it is asked to stop, instead of the 5s Pebble waits
+# by default before killing it
+KILL_DELAY = "60s"
+# Dynamic archives (-XX:ArchiveClassesAtExit) archive the classes of custom class loaders, like
+# the ones of Tomcat and its webapps, and are available since Java 13.
+MIN_JAVA_VERSION = 13
+# Files whose changes, when the image changes, invalidate the archive
+FINGERPRINT_FILES = [
+    ("/usr/local/tomcat/bin", "*.jar"),
+    ("/usr/local/tomcat/lib", "*.jar"),
+    ("/opt/guacamole", "*.war"),
+    ("/opt/guacamole/mysql", "*.jar"),
+]
+
+
+def parse_java_version(output: str) -> Optional[int]:
+    """Major Java version in the output of `java -version`, like 8 for "1.8.0_292"."""
+    match = re.search(r'version "(\d+)(?:\.(\d+))?', output)
+    if not match:
+        return None
+    major, minor = int(match.group(1)), int(match.group(2) or 0)
+    return minor if major == 1 else major
+
+
+def archive_to_dump(java_options: str) -> Optional[str]:
+    """Path of the archive the JVM writes when it exits, if the options ask for one."""
+    match = re.search(r"-XX:ArchiveClassesAtExit=(\S+)", java_options)
+    return match.group(1) if match else None
+
+
+class AppCDSArchive:
+    """Dynamic application class-data-sharing (AppCDS) archive.
+
+    The JVM dumps the classes it loaded to the archive when it exits, and maps them from the
+    archive on the following starts, instead of loading, parsing and verifying them again. The
+    archive is named after a fingerprint of the JVM and of the jars of Tomcat and Guacamole,
+    so a new image uses a new archive, and the archives of previous images are removed.
+
+    The archive is kept in the container filesystem, so a new pod generates it again.
+    """
+
+    def __init__(self, container: Container, java_home: str, path: str = APPCDS_DIR):
+        self.container = container
+        self.java_home = java_home
+        self.path = path
+
+    def java_options(self) -> str:
+        """JVM options to load the archive, or to dump it when the JVM exits if there is none.
+
+        Returns:
+            The options, or an empty string if the JVM does not support dynamic archives.
+        """
+        java_version = self._java_version()
+        if java_version is None or java_version < MIN_JAVA_VERSION:
+            logger.warning(
+                f"AppCDS disabled: Java {MIN_JAVA_VERSION} or later is needed, found {java_version}"
+            )
+            return ""
+        archive = self._archive()
+        if self.container.exists(archive):
+            return f"-XX:SharedArchiveFile={archive} -Xshare:auto"
+        return f"-XX:ArchiveClassesAtExit={archive}"
+
+    def _java_version(self) -> Optional[int]:
+        try:
+            process = self.container.exec([f"{self.java_home}/bin/java", "-version"])
+            _, version = process.wait_output()
+        except ExecError as e:
+            logger.warning(f"java -version failed: {e}")
+            return None
+        return parse_java_version(version or "")
+
+    def _archive(self) -> str:
+        files = [
+            (f.path, f.size, f.last_modified.isoformat())
+            for directory, pattern in [(f"{self.java_home}/lib", "modules"), *FINGERPRINT_FILES]
+            for f in self.container.list_files(directory, pattern=pattern)
+        ]
+        fingerprint = hashlib.sha256(repr(sorted(files)).encode()).hexdigest()[:16]
+        archive = f"{self.path}/guacamole-{fingerprint}.jsa"
+        self.container.make_dir(self.path, make_parents=True)
+        for stale in self.container.list_files(self.path, pattern="guacamole-*.jsa"):
+            if stale.path != archive:
+                logger.info(f"removing AppCDS archive of a previous image: {stale.path}")
+                self.container.remove_path(stale.path)
+        return archive
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Module to write and read database backups as compressed chunks of SQL statements."""
+
+import gzip
+import os
+import re
+from functools import partial
+from glob import glob
+from typing import Iterable, Iterator, List
+
+CHUNK_NAME = "guacamole-backup-{:05d}.sql.gz"
+CHUNK_GLOB = "guacamole-backup-*.sql.gz"
+READ_SIZE = 64 * 1024
+# Characters that change the state of the statement parser
+SPECIAL_CHARACTERS = re.compile(r"[;'\"`\\]")
+
+
+class BackupWriter:
+    """Writer of SQL statements to gzip-compressed chunk files.
+
+    A new chunk is started when the current one has chunk_size bytes of (uncompressed)
+    statements. Statements are never split across chunks, so every chunk can be read on its
+    own, and they are not kept in memory.
+    """
+
+    def __init__(self, directory: str, chunk_size: int):
+        if glob(os.path.join(directory, CHUNK_GLOB)):
+            raise ValueError(f"{directory} already has a backup")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.files: List[str] = []
+        self._file = None
+        self._written = 0
+
+    def write(self, statement: str):
+        """Write a statement, which must end with a semicolon."""
+        if not self._file or self._written >= self.chunk_size:
+            self._next_chunk()
+        data = f"{statement}\n".encode()
+        self._file.write(data)
+        self._written += len(data)
+
+    def close(self):
+        """Close the current chunk."""
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    @property
+    def compressed_size(self) -> int:
+        """Bytes of the chunks written."""
+        return sum(os.path.getsize(path) for path in self.files)
+
+    def __enter__(self):
+        """Open the writer."""
+        return self
+
+    def __exit__(self, *_):
+        """Close the current chunk."""
+        self.close()
+
+    def _next_chunk(self):
+        self.close()
+        path = os.path.join(self.directory, CHUNK_NAME.format(len(self.files)))
+        self._file = gzip.open(path, "wb")
+        self._written = 0
+        self.files.append(path)
+
+
+def iter_backup(directory: str) -> Iterator[str]:
+    """Read the text of the chunks of a backup, in order, in pieces of READ_SIZE characters.
+
+    Raises:
+        ValueError: if there is no backup in the directory.
+    """
+    paths = sorted(glob(os.path.join(directory, CHUNK_GLOB)))
+    if not paths:
+        raise ValueError(f"no backup found in {directory}")
+    for path in paths:
+        with gzip.open(path, "rt", encoding="utf-8") as chunk:
+            yield from iter(partial(chunk.read, READ_SIZE), "")
+
+
+def iter_statements(pieces: Iterable[str]) -> Iterator[str]:
+    """Split a stream of SQL text in statements, without reading it all in memory.
+
+    Semicolons inside quoted strings and identifiers, with backslash escapes, do not end a
+    statement. Only the statement being parsed is kept in memory.
+
+    Raises:
+        ValueError: if the text ends with an incomplete statement.
+    """
+    parser = StatementParser()
+    for piece in pieces:
+        yield from parser.feed(piece)
+    if parser.pending:
+        raise ValueError("the backup ends with an incomplete statement")
+
+
+class StatementParser:
+    """Incremental parser of SQL statements."""
+
+    def __init__(self):
+        self._statement = []
+        self._quote = None
+        self._escaped = False
+
+    @property
+    def pending(self) -> bool:
+        """Whether there is text of an incomplete statement."""
+        return bool("".join(self._statement).strip())
+
+    def feed(self, piece: str) -> Iterator[str]:
+        """Parse a piece of text, and return the statements it completes."""
+        start = position = 0
+        if self._escaped and piece:
+            # The previous piece ended with a backslash, this character is escaped
+            position, self._escaped = 1, False
+        while True:
+            match = SPECIAL_CHARACTERS.search(piece, position)
+            if not match:
+                break
+            position = match.end()
+            if match.group() == "\\":
+                position = self._skip_escaped(piece, position)
+            elif self._quote:
+                self._quote = None if match.group() == self._quote else self._quote
+            elif match.group() == ";":
+                self._statement.append(piece[start:position])
+                start = position
+                statement = "".join(self._statement).strip()
+                self._statement = []
+                if statement != ";":
+                    yield statement
+            else:
+                self._quote = match.group()
+        self._statement.append(piece[start:])
+
+    def _skip_escaped(self, piece: str, position: int) -> int:
+        if self._quote not in ("'", '"'):
+            return position
+        self._escaped = position == len(piece)
+        return position + 1
@@ -4,23 +4,61 @@
 
 """Guacamole charm module."""
 
+import hashlib
+import json
 import logging
 import socket
-from ipaddress import IPv4Address
+import time
+from ipaddress import IPv4Address, ip_network
 from typing import Optional
+from urllib.request import urlopen
 
+import yaml
 from charms.apache_guacd.v0.guacd import GuacdEvents, GuacdRequires
 from charms.nginx_ingress_integrator.v0.ingress import IngressRequires
 from charms.observability_libs.v0.kubernetes_service_patch import KubernetesServicePatch
-from ops.charm import CharmBase, ConfigChangedEvent, WorkloadEvent
+from ops.charm import (
+    ActionEvent,
+    CharmBase,
+    ConfigChangedEvent,
+    RelationChangedEvent,
+    WorkloadEvent,
+)
 from ops.framework import StoredState
-from ops.main import main
-from ops.model import ActiveStatus, BlockedStatus, MaintenanceStatus
+from ops.model import ActiveStatus, BlockedStatus, MaintenanceStatus, WaitingStatus
+from pymysql.err import MySQLError
 
-from mysql import Mysql, MysqlRequires
+from appcds import KILL_DELAY, AppCDSArchive, archive_to_dump
+from backup import BackupWriter, iter_backup, iter_statements
+from guacamole_home import GUACAMOLE_HOME, GUACAMOLE_HOME_TEMPLATE, GuacamoleHome
+from k8s_resources import KubernetesResourcesPatch, max_heap_size, resources_from_config
+from mysql import Mysql, MysqlRequires, RestoreError
+from payload import iter_balancing_groups, iter_connections, iter_users
+from rolling_restart import RollingRestart
+from state import main
+from tomcat import TomcatServer
+from warmup import warm_up
 
 logger = logging.getLogger(__name__)
 
+HISTORY_PRUNE_BATCH_SIZE = 1000
+JAVA_HOME = "/usr/local/openjdk-8"
+# Conditions of the nginx proxy_next_upstream directive
+INGRESS_RETRY_ERRORS = {
+    "error",
+    "timeout",
+    "invalid_header",
+    "http_500",
+    "http_502",
+    "http_503",
+    "http_504",
+    "http_403",
+    "http_404",
+    "http_429",
+    "non_idempotent",
+    "off",
+}
+
 
 def pod_ip() -> Optional[IPv4Address]:
     """Pod's IP address."""
@@ -28,6 +66,59 @@ def pod_ip() -> Optional[IPv4Address]:
     return IPv4Address(socket.gethostbyname(fqdn))
 
 
+def wait_for_http(url: str, timeout: float) -> Optional[float]:
+    """Wait until an url answers successfully.
+
+    Returns:
+        The seconds it took, or None if the url did not answer before the timeout.
+    """
+    start = time.monotonic()
+    while time.monotonic() - start < timeout:
+        try:
+            urlopen(url, timeout=5)
+            return time.monotonic() - start
+        except OSError:
+            time.sleep(1)
+
+
+def throughput(count: int, start: float, unit: str = "rows") -> dict:
+    """Action results with the elapsed time and throughput of an operation started at start."""
+    elapsed = time.monotonic() - start
+    return {
+        "elapsed-seconds": round(elapsed, 3),
+        f"{unit}-per-second": round(count / elapsed) if elapsed else count,
+    }
+
+
+def ingress_limits(config: dict) -> dict:
+    """Admission-control fields of the ingress relation, from the ingress-* config.
+
+    Unset options are empty strings, which remove the fields from the relation data.
+
+    Raises:
+        ValueError: if an option is not valid.
+    """
+    for option in ("ingress-limit-rps", "ingress-max-body-size"):
+        if config[option] < 0:
+            raise ValueError(f"{option} must not be negative: {config[option]}")
+    whitelist = [cidr.strip() for cidr in config["ingress-limit-whitelist"].split(",")]
+    retry_errors = [error.strip() for error in config["ingress-retry-errors"].split(",")]
+    for cidr in filter(None, whitelist):
+        try:
+            ip_network(cidr, strict=False)
+        except ValueError:
+            raise ValueError(f"ingress-limit-whitelist has an invalid network: {cidr}")
+    invalid_errors = sorted(set(filter(None, retry_errors)) - INGRESS_RETRY_ERRORS)
+    if invalid_errors:
+        raise ValueError(f"ingress-retry-errors has invalid errors: {', '.join(invalid_errors)}")
+    return {
+        "limit-rps": config["ingress-limit-rps"] or "",
+        "limit-whitelist": ",".join(filter(None, whitelist)),
+        "max-body-size": config["ingress-max-body-size"] or "",
+        "retry-errors": ",".join(filter(None, retry_errors)),
+    }
+
+
 class ApacheGuacamoleCharm(CharmBase):
     """Apache Guacamole Charm operator."""
 
@@ -38,25 +129,33 @@ class ApacheGuacamoleCharm(CharmBase):
         super().__init__(*args)
         self._port = 8080
         self.guacd = GuacdRequires(self, self._stored)
+        self.guacamole_home = GuacamoleHome(self.container)
+        self.guacamole_home_template = GuacamoleHome(self.container, GUACAMOLE_HOME_TEMPLATE)
+        self.tomcat = TomcatServer(self.container)
+        self.appcds = AppCDSArchive(self.container, JAVA_HOME)
+        self.rolling_restart = RollingRestart(self, self._on_restart_turn)
         self.mysql = MysqlRequires(self)
         KubernetesServicePatch(self, [(f"{self.app.name}", self._port)])
-        self.ingress = IngressRequires(
-            self,
-            {
-                "service-hostname": self._external_hostname,
-                "service-name": self.app.name,
-                "service-port": self._port,
-            },
-        )
+        self.resources_patch = KubernetesResourcesPatch(self, "guacamole")
+        self.ingress = IngressRequires(self, self._ingress_config)
         event_observe_mapping = {
             self.on.guacamole_pebble_ready: self._on_guacamole_pebble_ready,
             self.on.config_changed: self._on_config_changed,
             self.on.guacd_changed: self._on_config_changed,
             self.on.mysql_relation_changed: self._on_config_changed,
+            self.on.cluster_relation_changed: self._on_cluster_relation_changed,
+            self.on.update_status: self._on_update_status,
+            self.on.prune_history_action: self._on_prune_history_action,
+            self.on.import_connections_action: self._on_import_connections_action,
+            self.on.provision_users_action: self._on_provision_users_action,
+            self.on.sync_balancing_groups_action: self._on_sync_balancing_groups_action,
+            self.on.session_stats_action: self._on_session_stats_action,
+            self.on.backup_action: self._on_backup_action,
+            self.on.restore_action: self._on_restore_action,
         }
         for event, observer in event_observe_mapping.items():
             self.framework.observe(event, observer)
-        self._stored.set_default(db_initialized=False)
+        self._stored.set_default(schema_fingerprint=None)
 
     @property
     def container(self):
@@ -69,18 +168,165 @@ class ApacheGuacamoleCharm(CharmBase):
         return self.container.get_plan().services
 
     def _on_guacamole_pebble_ready(self, _: WorkloadEvent):
-        self._restart()
+        # A new pod serves no sessions yet, there is no need to wait for a restart turn.
+        self._restart(rolling=False)
 
     def _on_config_changed(self, event: ConfigChangedEvent):
+        self._patch_resources()
         if self.container.can_connect():
             self._restart()
-            self.ingress.update_config({"service-hostname": self._external_hostname})
+            self.ingress.update_config(self._ingress_config)
         else:
             logger.info("pebble socket not available, deferring config-changed")
             event.defer()
             self.unit.status = MaintenanceStatus("waiting for pebble to start")
 
-    def _restart(self):
+    def _on_cluster_relation_changed(self, event: RelationChangedEvent):
+        schema_fingerprint = event.relation.data[self.app].get("schema-fingerprint")
+        if schema_fingerprint != self._stored.schema_fingerprint:
+            self._on_config_changed(event)
+
+    def _on_update_status(self, _):
+        retention_days = self.config.get("history-retention-days")
+        if (
+            retention_days
+            and self.unit.is_leader()
+            and self._stored.schema_fingerprint
+            and not self.mysql.is_missing_data_in_unit()
+        ):
+            try:
+                results = self._prune_history(retention_days, HISTORY_PRUNE_BATCH_SIZE)
+            except MySQLError as e:
+                logger.error(f"periodic connection history prune failed: {e}")
+                return
+            logger.info(f"periodic connection history prune: {results}")
+
+    def _on_prune_history_action(self, event: ActionEvent):
+        retention_days = event.params.get("retention-days") or self.config.get(
+            "history-retention-days"
+        )
+        if not retention_days:
+            event.fail("retention-days must be set in the action or history-retention-days config")
+            return
+        if self.mysql.is_missing_data_in_unit():
+            event.fail("missing relations: mysql")
+            return
+        batch_size = event.params.get("batch-size", HISTORY_PRUNE_BATCH_SIZE)
+        try:
+            results = self._prune_history(retention_days, batch_size)
+        except MySQLError as e:
+            event.fail(f"database error: {e}")
+            return
+        event.set_results(results)
+
+    def _prune_history(self, retention_days: int, batch_size: int) -> dict:
+        start = time.monotonic()
+        deleted = self._get_mysql().prune_history(retention_days, batch_size)
+        return {"deleted": deleted, **throughput(deleted, start)}
+
+    def _on_import_connections_action(self, event: ActionEvent):
+        if self.mysql.is_missing_data_in_unit():
+            event.fail("missing relations: mysql")
+            return
+        connections = iter_connections(event.params["connections"], event.params["format"])
+        start = time.monotonic()
+        try:
+            results = self._get_mysql().import_connections(connections, event.params["batch-size"])
+        except (ValueError, yaml.YAMLError) as e:
+            event.fail(f"invalid connections: {e}")
+            return
+        except MySQLError as e:
+            event.fail(f"database error: {e}")
+            return
+        event.set_results({**results, **throughput(sum(results.values()), start)})
+
+    def _on_provision_users_action(self, event: ActionEvent):
+        if self.mysql.is_missing_data_in_unit():
+            event.fail("missing relations: mysql")
+            return
+        users = iter_users(event.params["users"], event.params["format"])
+        start = time.monotonic()
+        try:
+            results = self._get_mysql().provision_users(
+                users, event.params["batch-size"], event.params["hash-workers"]
+            )
+        except (ValueError, yaml.YAMLError) as e:
+            event.fail(f"invalid users: {e}")
+            return
+        except MySQLError as e:
+            event.fail(f"database error: {e}")
+            return
+        event.set_results({**results, **throughput(sum(results.values()), start, "users")})
+
+    def _on_sync_balancing_groups_action(self, event: ActionEvent):
+        if self.mysql.is_missing_data_in_unit():
+            event.fail("missing relations: mysql")
+            return
+        try:
+            groups = list(iter_balancing_groups(event.params["groups"]))
+        except (ValueError, yaml.YAMLError) as e:
+            event.fail(f"invalid groups: {e}")
+            return
+        try:
+            results = self._get_mysql().sync_balancing_groups(groups)
+        except MySQLError as e:
+            event.fail(f"database error: {e}")
+            return
+        event.set_results(results)
+
+    def _on_session_stats_action(self, event: ActionEvent):
+        if self.mysql.is_missing_data_in_unit():
+            event.fail("missing relations: mysql")
+            return
+        start = time.monotonic()
+        try:
+            stats = self._get_mysql().session_stats(
+                event.params["window-hours"], self.guacd.hostname, event.params["limit"]
+            )
+        except MySQLError as e:
+            event.fail(f"database error: {e}")
+            return
+        event.set_results(
+            {
+                "stats": json.dumps(stats, separators=(",", ":")),
+                "elapsed-seconds": round(time.monotonic() - start, 3),
+            }
+        )
+
+    def _on_backup_action(self, event: ActionEvent):
+        if self.mysql.is_missing_data_in_unit():
+            event.fail("missing relations: mysql")
+            return
+        start = time.monotonic()
+        try:
+            with BackupWriter(event.params["path"], event.params["chunk-size"] * 2**20) as writer:
+                results = self._get_mysql().backup(writer, event.params["batch-size"])
+        except (ValueError, OSError, MySQLError) as e:
+            event.fail(f"backup failed: {e}")
+            return
+        event.set_results(
+            {
+                **results,
+                "chunks": len(writer.files),
+                "compressed-bytes": writer.compressed_size,
+                **throughput(results["rows"], start),
+            }
+        )
+
+    def _on_restore_action(self, event: ActionEvent):
+        if self.mysql.is_missing_data_in_unit():
+            event.fail("missing relations: mysql")
+            return
+        start = time.monotonic()
+        try:
+            statements = iter_statements(iter_backup(event.params["path"]))
+            results = self._get_mysql().restore(statements)
+        except (ValueError, OSError, MySQLError, RestoreError) as e:
+            event.fail(f"restore failed: {e}")
+            return
+        event.set_results({**results, **throughput(results["rows"], start)})
+
+    def _restart(self, rolling: bool = True):
         missing_relations = []
         if not self.guacd.hostname or not self.guacd.port:
             missing_relations.append("guacd")
@@ -89,20 +335,50 @@ class ApacheGuacamoleCharm(CharmBase):
         if missing_relations:
             self.unit.status = BlockedStatus(f'missing relations: {", ".join(missing_relations)}')
             return
-        if not self._stored.db_initialized:
-            sql_script = self._get_initdb_sql()
-            mysql = Mysql(
-                self.mysql.host,
-                int(self.mysql.port),
-                self.mysql.user,
-                self.mysql.password,
-                self.mysql.database,
-            )
-            mysql.execute(sql_script)
-            self._stored.db_initialized = True
-        layer = self._get_pebble_layer()
+        try:
+            heap = self._max_heap_size
+            ingress_limits(self.config)
+            self._render_config_files()
+        except ValueError as e:
+            self.unit.status = BlockedStatus(f"invalid config: {e}")
+            return
+        if not self._initialize_database():
+            self.unit.status = WaitingStatus("waiting for leader to initialize the database")
+            return
+        layer = self._get_pebble_layer(self._java_options(heap))
         self._set_pebble_layer(layer)
-        self._restart_service()
+        if not rolling:
+            self._on_restart_turn()
+        elif not self.rolling_restart.request():
+            self.unit.status = MaintenanceStatus("waiting for rolling restart")
+
+    def _render_config_files(self):
+        log_level = self.config["log-level"]
+        if self.config["fast-start"]:
+            self.guacamole_home.render(self._guacamole_properties, log_level)
+        else:
+            self.guacamole_home_template.render_template(log_level)
+        self.tomcat.configure_log_level(log_level)
+        self.tomcat.configure_access_log(self.config["access-log"])
+        self.tomcat.configure_static_assets(
+            self.config["static-assets-max-age"], self.config["static-assets-precompressed"]
+        )
+
+    def _patch_resources(self):
+        try:
+            requests, limits = resources_from_config(self.config)
+        except ValueError as e:
+            logger.error(f"resources not patched, invalid config: {e}")
+            return
+        self.resources_patch.patch(requests, limits)
+
+    def _on_restart_turn(self) -> bool:
+        if not self._restart_service() or not self._generate_appcds_archive():
+            self.unit.status = BlockedStatus("guacamole did not start")
+            return False
+        if self.config["static-assets-precompressed"]:
+            self.tomcat.precompress_webapp("guacamole")
+        self._warm_up()
         if self.unit.is_leader():
             hostname = (
                 self.config["external-hostname"]
@@ -112,44 +388,184 @@ class ApacheGuacamoleCharm(CharmBase):
             self.unit.status = ActiveStatus(f"Go to http://{hostname}/guacamole")
         else:
             self.unit.status = ActiveStatus()
+        return True
 
-    def _restart_service(self):
+    def _restart_service(self) -> bool:
         container = self.container
         if "guacamole" in self.services:
+            start = time.monotonic()
             container.restart("guacamole")
             logger.info("guacamole service has been restarted")
+            return self._wait_for_guacamole(start)
+        return True
+
+    def _wait_for_guacamole(self, start: float) -> bool:
+        timeout = self.config["startup-timeout"]
+        if not timeout:
+            return True
+        ready = wait_for_http(f"http://localhost:{self._port}/guacamole/", timeout)
+        fast_start = "on" if self.config["fast-start"] else "off"
+        if ready is None:
+            logger.warning(f"guacamole did not start in {timeout}s (fast-start: {fast_start})")
+            return False
+        elapsed = time.monotonic() - start
+        logger.info(
+            f"guacamole started in {elapsed:.1f}s"
+            f" (fast-start: {fast_start}, appcds: {self._appcds_mode})"
+        )
+        return True
+
+    @property
+    def _appcds_mode(self) -> str:
+        service = self.services.get("guacamole")
+        java_options = service.environment.get("JAVA_OPTS", "") if service else ""
+        if "-XX:SharedArchiveFile=" in java_options:
+            return "loaded"
+        if "-XX:ArchiveClassesAtExit=" in java_options:
+            return "dumping"
+        return "off"
+
+    def _generate_appcds_archive(self) -> bool:
+        if self._appcds_mode != "dumping":
+            return True
+        # The archive has the classes loaded until the JVM exits, warm-up ones included
+        self.unit.status = MaintenanceStatus("generating the AppCDS archive")
+        self._warm_up()
+        archive = archive_to_dump(self.services["guacamole"].environment["JAVA_OPTS"])
+        self.container.stop("guacamole")
+        heap = self._max_heap_size
+        if self.container.exists(archive):
+            logger.info("AppCDS archive generated, restarting guacamole to load it")
+            java_options = self._java_options(heap)
+        else:
+            logger.warning(f"the JVM did not write {archive}, restarting guacamole without it")
+            java_options = self._java_options(heap, appcds=False)
+        self._set_pebble_layer(self._get_pebble_layer(java_options))
+        return self._restart_service()
+
+    def _warm_up(self):
+        paths = [path.strip() for path in self.config["warm-up-paths"].split(",") if path.strip()]
+        if not paths:
+            return
+        self.unit.status = MaintenanceStatus("warming up")
+        timeout = self.config["warm-up-timeout"]
+        elapsed = warm_up(
+            f"http://localhost:{self._port}/guacamole",
+            paths,
+            self.config["warm-up-latency-threshold"] / 1000,
+            timeout,
+        )
+        if elapsed is None:
+            logger.warning(f"guacamole latency did not settle in the {timeout}s warm-up")
+        else:
+            logger.info(f"guacamole warmed up in {elapsed:.1f}s")
 
-    def _get_pebble_layer(self):
+    @property
+    def _max_heap_size(self) -> Optional[int]:
+        # Keep the heap, and the memory the JVM uses besides it, under the container memory limit
+        _, limits = resources_from_config(self.config)
+        return max_heap_size(limits.get("memory"), self.config["jvm-heap-percentage"])
+
+    def _java_options(self, heap_size: Optional[int], appcds: bool = True) -> str:
+        options = [f"-Xmx{heap_size}m"] if heap_size else []
+        if appcds and self.config["appcds"]:
+            options.append(self.appcds.java_options())
+        return " ".join(filter(None, options))
+
+    def _get_pebble_layer(self, java_options: str = ""):
+        environment = {
+            "PATH": f"/usr/local/tomcat/bin:{JAVA_HOME}/bin:/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin",
+            "LANG": "C.UTF-8",
+            "JAVA_HOME": JAVA_HOME,
+            "CATALINA_HOME": "/usr/local/tomcat",
+            "TOMCAT_NATIVE_LIBDIR": "/usr/local/tomcat/native-jni-lib",
+            "LD_LIBRARY_PATH": "/usr/local/tomcat/native-jni-lib",
+        }
+        if java_options:
+            environment["JAVA_OPTS"] = java_options
+        if self.config["fast-start"]:
+            command = "/usr/local/tomcat/bin/catalina.sh run"
+            environment["GUACAMOLE_HOME"] = GUACAMOLE_HOME
+        else:
+            command = "/opt/guacamole/bin/start.sh"
+            environment.update(
+                {
+                    "GUACAMOLE_HOME": GUACAMOLE_HOME_TEMPLATE,
+                    "MYSQL_HOSTNAME": self.mysql.host,
+                    "MYSQL_PORT": self.mysql.port,
+                    "MYSQL_DATABASE": self.mysql.database,
+                    "MYSQL_USER": self.mysql.user,
+                    "MYSQL_PASSWORD": self.mysql.password,
+                    "GUACD_HOSTNAME": self.guacd.hostname,
+                    "GUACD_PORT": self.guacd.port,
+                }
+            )
+        service = {
+            "override": "replace",
+            "summary": "guacamole service",
+            "command": command,
+            "startup": "enabled",
+            "environment": environment,
+        }
+        if self.config["appcds"]:
+            service["kill-delay"] = KILL_DELAY
         return {
             "summary": "guacamole layer",
             "description": "pebble config layer for httpbin",
-            "services": {
-                "guacamole": {
-                    "override": "replace",
-                    "summary": "guacamole service",
-                    "command": "/opt/guacamole/bin/start.sh",
-                    "startup": "enabled",
-                    "environment": {
-                        "PATH": "/usr/local/tomcat/bin:/usr/local/openjdk-8/bin:/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin",
-                        "LANG": "C.UTF-8",
-                        "JAVA_HOME": "/usr/local/openjdk-8",
-                        "CATALINA_HOME": "/usr/local/tomcat",
-                        "TOMCAT_NATIVE_LIBDIR": "/usr/local/tomcat/native-jni-lib",
-                        "LD_LIBRARY_PATH": "/usr/local/tomcat/native-jni-lib",
-                        "MYSQL_HOSTNAME": self.mysql.host,
-                        "MYSQL_PORT": self.mysql.port,
-                        "MYSQL_DATABASE": self.mysql.database,
-                        "MYSQL_USER": self.mysql.user,
-                        "MYSQL_PASSWORD": self.mysql.password,
-                        "GUACD_HOSTNAME": self.guacd.hostname,
-                        "GUACD_PORT": self.guacd.port,
-                    },
-                }
-            },
+            "services": {"guacamole": service},
+        }
+
+    @property
+    def _guacamole_properties(self) -> dict:
+        return {
+            "guacd-hostname": self.guacd.hostname,
+            "guacd-port": self.guacd.port,
+            "mysql-hostname": self.mysql.host,
+            "mysql-port": self.mysql.port,
+            "mysql-database": self.mysql.database,
+            "mysql-username": self.mysql.user,
+            "mysql-password": self.mysql.password,
         }
 
     def _set_pebble_layer(self, layer):
-        self.container.add_layer("guacamole", layer, combine=True)
+        # Added as yaml: the layer dicts of this version of ops drop the kill-delay
+        self.container.add_layer("guacamole", yaml.safe_dump(layer), combine=True)
+
+    def _get_mysql(self) -> Mysql:
+        return Mysql(
+            self.mysql.host,
+            int(self.mysql.port),
+            self.mysql.user,
+            self.mysql.password,
+            self.mysql.database,
+        )
+
+    def _initialize_database(self) -> bool:
+        """Initialize the database schema, only from the leader unit.
+
+        The leader publishes the fingerprint of the initialized schema in the peer relation, so
+        that the other units know that the database is ready without touching it.
+
+        Returns:
+            True if the database schema is initialized.
+        """
+        peers = self.model.get_relation("cluster")
+        schema_fingerprint = (
+            peers.data[self.app].get("schema-fingerprint")
+            if peers
+            else self._stored.schema_fingerprint
+        )
+        if self.unit.is_leader():
+            sql_script = self._get_initdb_sql()
+            database = f"{self.mysql.host}:{self.mysql.port}/{self.mysql.database}"
+            fingerprint = hashlib.sha256(f"{database}\n{sql_script}".encode()).hexdigest()
+            if fingerprint != schema_fingerprint:
+                self._get_mysql().execute(sql_script)
+                schema_fingerprint = fingerprint
+                if peers:
+                    peers.data[self.app]["schema-fingerprint"] = fingerprint
+        self._stored.schema_fingerprint = schema_fingerprint
+        return bool(schema_fingerprint)
 
     def _get_initdb_sql(self):
         process = self.container.exec(
@@ -158,6 +574,19 @@ class ApacheGuacamoleCharm(CharmBase):
         sql, _ = process.wait_output()
         return sql
 
+    @property
+    def _ingress_config(self) -> dict:
+        config = {
+            "service-hostname": self._external_hostname,
+            "service-name": self.app.name,
+            "service-port": self._port,
+        }
+        try:
+            config.update(ingress_limits(self.config))
+        except ValueError as e:
+            logger.error(f"ingress limits not updated, invalid config: {e}")
+        return config
+
     @property
     def _external_hostname(self) -> str:
         """Return the external hostname to be passed to ingress via the relation."""
@@ -169,4 +598,4 @@ class ApacheGuacamoleCharm(CharmBase):
 
 
 if __name__ == "__main__":  # pragma: no cover
-    main(ApacheGuacamoleCharm, use_juju_for_storage=True)
+    main(ApacheGuacamoleCharm)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Module to render GUACAMOLE_HOME in the guacamole container."""
+
+import hashlib
+import logging
+
+from ops.model import Container
+
+logger = logging.getLogger(__name__)
+
+GUACAMOLE_HOME = "/etc/guacamole"
+GUACAMOLE_HOME_TEMPLATE = "/etc/guacamole-template"
+MYSQL_JARS_DIR = "/opt/guacamole/mysql"
+GUACAMOLE_WAR = "/opt/guacamole/guacamole.war"
+WEBAPPS_DIR = "/usr/local/tomcat/webapps"
+FINGERPRINT_FILE = ".charm-fingerprint"
+LOG_LEVELS = ("error", "warn", "info", "debug", "trace")
+LOGBACK_XML = """<configuration>
+    <appender name="GUAC-DEFAULT" class="ch.qos.logback.core.ConsoleAppender">
+        <encoder>
+            <pattern>%d{{HH:mm:ss.SSS}} [%thread] %-5level %logger{{36}} - %msg%n</pattern>
+        </encoder>
+    </appender>
+    <root level="{level}">
+        <appender-ref ref="GUAC-DEFAULT" />
+    </root>
+</configuration>
+"""
+
+
+class GuacamoleHome:
+    """GUACAMOLE_HOME rendered by the charm.
+
+    It is the equivalent of what /opt/guacamole/bin/start.sh does on every start: writing
+    guacamole.properties and linking the mysql extension, the mysql driver, and the webapp.
+    Rendering it from the charm allows catalina to be started directly. The files are only
+    written when their content changes, which is tracked with a fingerprint file.
+
+    When start.sh is used, only a template is rendered, which start.sh copies to the
+    GUACAMOLE_HOME it generates.
+    """
+
+    def __init__(self, container: Container, path: str = GUACAMOLE_HOME):
+        self.container = container
+        self.path = path
+
+    def render(self, properties: dict, log_level: str = "info") -> bool:
+        """Render GUACAMOLE_HOME with the given guacamole properties and log level.
+
+        Returns:
+            True if GUACAMOLE_HOME has been (re)written, False if it was up to date.
+
+        Raises:
+            ValueError: if the log level is not valid.
+        """
+        files = {
+            "guacamole.properties": render_properties(properties),
+            "logback.xml": render_logback(log_level),
+        }
+        jars = sorted(f.path for f in self.container.list_files(MYSQL_JARS_DIR, pattern="*.jar"))
+        fingerprint = hashlib.sha256(repr((sorted(files.items()), jars)).encode()).hexdigest()
+        if fingerprint == self._fingerprint:
+            return False
+        self._push(files)
+        self._link([jar for jar in jars if "guacamole-auth-" in jar], f"{self.path}/extensions")
+        self._link([jar for jar in jars if "mysql-connector-" in jar], f"{self.path}/lib")
+        self._link([GUACAMOLE_WAR], WEBAPPS_DIR)
+        self.container.push(f"{self.path}/{FINGERPRINT_FILE}", fingerprint)
+        logger.info(f"{self.path} has been rendered")
+        return True
+
+    def render_template(self, log_level: str = "info") -> bool:
+        """Render a GUACAMOLE_HOME template, with the logback configuration only.
+
+        Returns:
+            True if the template has been (re)written, False if it was up to date.
+
+        Raises:
+            ValueError: if the log level is not valid.
+        """
+        files = {"logback.xml": render_logback(log_level)}
+        fingerprint = hashlib.sha256(repr(sorted(files.items())).encode()).hexdigest()
+        if fingerprint == self._fingerprint:
+            return False
+        self._push(files)
+        # start.sh copies the whole template, fingerprint included, which is harmless
+        self.container.push(f"{self.path}/{FINGERPRINT_FILE}", fingerprint)
+        logger.info(f"{self.path} has been rendered")
+        return True
+
+    @property
+    def _fingerprint(self):
+        path = f"{self.path}/{FINGERPRINT_FILE}"
+        if self.container.exists(path):
+            return self.container.pull(path).read()
+
+    def _push(self, files: dict):
+        for name, content in files.items():
+            self.container.push(f"{self.path}/{name}", content, make_dirs=True, permissions=0o600)
+
+    def _link(self, targets: list, directory: str):
+        self.container.make_dir(directory, make_parents=True)
+        if targets:
+            self.container.exec(["ln", "-sf", *targets, f"{directory}/"]).wait()
+
+
+def render_properties(properties: dict) -> str:
+    """Render the content of guacamole.properties."""
+    return "".join(f"{key}: {value}\n" for key, value in sorted(properties.items()))
+
+
+def render_logback(level: str) -> str:
+    """Render the content of logback.xml, logging to the console with the given level.
+
+    Raises:
+        ValueError: if the log level is not valid.
+    """
+    if level not in LOG_LEVELS:
+        raise ValueError(f"log-level must be one of {', '.join(LOG_LEVELS)}: {level}")
+    return LOGBACK_XML.format(level=level)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Module to manage the CPU and memory requests and limits of the workload container."""
+
+import logging
+from decimal import Decimal
+from typing import Dict, Optional, Tuple
+
+from lightkube import ApiError, Client
+from lightkube.resources.apps_v1 import StatefulSet
+from lightkube.types import PatchType
+from lightkube.utils.quantity import parse_quantity
+from ops.charm import CharmBase
+from ops.framework import Object
+
+logger = logging.getLogger(__name__)
+
+RESOURCES = ("cpu", "memory")
+
+
+def resources_from_config(config: dict) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """Get the resource requests and limits from the {cpu,memory}-{request,limit} config.
+
+    Args:
+        config: charm config.
+
+    Returns:
+        Requests and limits, like {"cpu": "500m", "memory": "1Gi"}, without the unset ones.
+
+    Raises:
+        ValueError: if a value is not a Kubernetes quantity, or a request exceeds its limit.
+    """
+    requests, limits = {}, {}
+    for resource in RESOURCES:
+        for kind, values in [("request", requests), ("limit", limits)]:
+            value = (config.get(f"{resource}-{kind}") or "").strip()
+            if not value:
+                continue
+            try:
+                quantity = parse_quantity(value)
+            except ValueError:
+                quantity = None
+            if not quantity or quantity < 0:
+                raise ValueError(f"{resource}-{kind} must be a positive quantity: {value}")
+            values[resource] = value
+        if (
+            resource in requests
+            and resource in limits
+            and parse_quantity(requests[resource]) > parse_quantity(limits[resource])
+        ):
+            raise ValueError(f"{resource}-request exceeds {resource}-limit")
+    return requests, limits
+
+
+def max_heap_size(memory_limit: Optional[str], heap_percentage: int) -> Optional[int]:
+    """Maximum JVM heap size, in MiB, for a memory limit, or None if there is no limit.
+
+    Raises:
+        ValueError: if the heap percentage is not between 1 and 100.
+    """
+    if not 1 <= heap_percentage <= 100:
+        raise ValueError(f"jvm-heap-percentage must be between 1 and 100: {heap_percentage}")
+    if not memory_limit:
+        return None
+    heap = parse_quantity(memory_limit) * Decimal(heap_percentage) / 100 / 2**20
+    return max(int(heap), 1)
+
+
+class KubernetesResourcesPatch(Object):
+    """Patch the resources of a container in the StatefulSet created by Juju.
+
+    Kubernetes recreates the pods of the StatefulSet, one at a time, when its pod template
+    changes, so the patch is only applied, by the leader, when the requested resources differ
+    from the current ones. Like KubernetesServicePatch, it needs the application to be trusted.
+    """
+
+    def __init__(self, charm: CharmBase, container_name: str):
+        super().__init__(charm, "kubernetes-resources-patch")
+        self.charm = charm
+        self.container_name = container_name
+
+    def patch(self, requests: Dict[str, str], limits: Dict[str, str]) -> bool:
+        """Set the resource requests and limits of the container, removing the unset ones.
+
+        Returns:
+            True if the StatefulSet was patched, False if it did not need to, or failed.
+        """
+        if not self.charm.unit.is_leader():
+            return False
+        client = Client()
+        app, namespace = self.model.app.name, self.model.name
+        try:
+            statefulset = client.get(StatefulSet, app, namespace=namespace)
+            current_requests, current_limits = self._current_resources(statefulset)
+            if _equals(current_requests, requests) and _equals(current_limits, limits):
+                return False
+            client.patch(
+                StatefulSet,
+                app,
+                self._patch_object(requests, limits),
+                namespace=namespace,
+                patch_type=PatchType.STRATEGIC,
+            )
+        except ApiError as e:
+            if e.status.code == 403:
+                logger.error("Kubernetes resources patch failed: `juju trust` this application.")
+            else:
+                logger.error(f"Kubernetes resources patch failed: {e}")
+            return False
+        logger.info(f"StatefulSet {app} patched with requests {requests} and limits {limits}")
+        return True
+
+    def _current_resources(self, statefulset: StatefulSet) -> Tuple[dict, dict]:
+        container = next(
+            c for c in statefulset.spec.template.spec.containers if c.name == self.container_name
+        )
+        if not container.resources:
+            return {}, {}
+        return container.resources.requests or {}, container.resources.limits or {}
+
+    def _patch_object(self, requests: Dict[str, str], limits: Dict[str, str]) -> dict:
+        # Null values remove the resources that are no longer set
+        return {
+            "spec": {
+                "template": {
+                    "spec": {
+                        "containers": [
+                            {
+                                "name": self.container_name,
+                                "resources": {
+                                    "requests": {r: requests.get(r) for r in RESOURCES},
+                                    "limits": {r: limits.get(r) for r in RESOURCES},
+                                },
+                            }
+                        ]
+                    }
+                }
+            }
+        }
+
+
+def _equals(current: Dict[str, str], wanted: Dict[str, str]) -> bool:
+    current = {r: v for r, v in current.items() if r in RESOURCES}
+    return current.keys() == wanted.keys() and all(
+        parse_quantity(current[r]) == parse_quantity(wanted[r]) for r in wanted
+    )
@@ -3,14 +3,183 @@
 # See LICENSE file for licensing details.
 
 """Module that includes functions to communicate with mysql."""
+import hashlib
 import logging
+import secrets
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Iterable, Iterator, List
 
 import ops.charm
 import pymysql.cursors
 from ops.framework import Object
+from pymysql.err import MySQLError
+
+from backup import BackupWriter
 
 logger = logging.getLogger(__name__)
 
+HISTORY_CUTOFF_QUERY = "SELECT NOW() - INTERVAL %s DAY AS cutoff"
+PRUNE_HISTORY_QUERY = (
+    "DELETE FROM guacamole_connection_history WHERE start_date < %s ORDER BY history_id LIMIT %s"
+)
+SESSION_STATS_SINCE_QUERY = "SELECT NOW() - INTERVAL %s HOUR AS since"
+# Active sessions have no end_date, and are found through the end_date index.
+ACTIVE_SESSIONS_QUERY = (
+    "SELECT COUNT(*) AS sessions FROM guacamole_connection_history WHERE end_date IS NULL"
+)
+ACTIVE_SESSIONS_BY_CONNECTION_QUERY = (
+    "SELECT connection_name AS name, COUNT(*) AS sessions FROM guacamole_connection_history"
+    " WHERE end_date IS NULL GROUP BY connection_id, connection_name"
+    " ORDER BY sessions DESC LIMIT %s"
+)
+ACTIVE_SESSIONS_BY_USER_QUERY = (
+    "SELECT username AS name, COUNT(*) AS sessions FROM guacamole_connection_history"
+    " WHERE end_date IS NULL GROUP BY username ORDER BY sessions DESC LIMIT %s"
+)
+ACTIVE_SESSIONS_BY_GUACD_QUERY = (
+    "SELECT COALESCE(c.proxy_hostname, %s) AS name, COUNT(*) AS sessions"
+    " FROM guacamole_connection_history h"
+    " LEFT JOIN guacamole_connection c ON c.connection_id = h.connection_id"
+    " WHERE h.end_date IS NULL GROUP BY name ORDER BY sessions DESC LIMIT %s"
+)
+# Running sum of +1 (session start, or window start for older sessions) and -1 (session end)
+# events. Each branch is a range scan on the start_date or end_date index.
+PEAK_CONCURRENT_SESSIONS_QUERY = (
+    "SELECT COALESCE(MAX(concurrent), 0) AS peak FROM ("
+    " SELECT SUM(delta) OVER (ORDER BY ts, delta ROWS UNBOUNDED PRECEDING) AS concurrent FROM ("
+    "  SELECT start_date AS ts, 1 AS delta FROM guacamole_connection_history"
+    "  WHERE start_date >= %(since)s"
+    "  UNION ALL SELECT %(since)s, 1 FROM guacamole_connection_history"
+    "  WHERE start_date < %(since)s AND (end_date IS NULL OR end_date >= %(since)s)"
+    "  UNION ALL SELECT end_date, -1 FROM guacamole_connection_history"
+    "  WHERE end_date >= %(since)s"
+    " ) AS events"
+    ") AS running"
+)
+BACKUP_SNAPSHOT_QUERY = "START TRANSACTION WITH CONSISTENT SNAPSHOT"
+BACKUP_TABLES_QUERY = "SHOW FULL TABLES WHERE Table_type = 'BASE TABLE'"
+# Connections are identified by name in the root group and in its balancing groups, where
+# sync_balancing_groups moves them. If a name is in both, the connection of the balancing group
+# comes last, and wins.
+SELECT_CONNECTION_IDS_QUERY = (
+    "SELECT c.connection_id, c.connection_name FROM guacamole_connection c"
+    " LEFT JOIN guacamole_connection_group g ON g.connection_group_id = c.parent_id"
+    " WHERE c.connection_name IN ({}) AND (c.parent_id IS NULL"
+    " OR (g.type = 'BALANCING' AND g.parent_id IS NULL))"
+    " ORDER BY c.parent_id IS NOT NULL"
+)
+INSERT_CONNECTION_QUERY = (
+    "INSERT INTO guacamole_connection (connection_name, protocol, max_connections)"
+    " VALUES (%s, %s, %s)"
+)
+UPDATE_CONNECTION_QUERY = (
+    "UPDATE guacamole_connection SET protocol = %s,"
+    " max_connections = COALESCE(%s, max_connections) WHERE connection_id = %s"
+)
+DELETE_CONNECTION_PARAMETERS_QUERY = (
+    "DELETE FROM guacamole_connection_parameter WHERE connection_id IN ({})"
+)
+INSERT_CONNECTION_PARAMETER_QUERY = (
+    "INSERT INTO guacamole_connection_parameter (connection_id, parameter_name, parameter_value)"
+    " VALUES (%s, %s, %s)"
+)
+INSERT_CONNECTION_PERMISSION_QUERY = (
+    "INSERT IGNORE INTO guacamole_connection_permission (entity_id, connection_id, permission)"
+    " SELECT entity_id, %s, 'READ' FROM guacamole_entity WHERE type = %s AND name = %s"
+)
+
+SELECT_EXISTING_USERS_QUERY = (
+    "SELECT e.name FROM guacamole_entity e JOIN guacamole_user u ON u.entity_id = e.entity_id"
+    " WHERE e.type = 'USER' AND e.name IN ({})"
+)
+INSERT_ENTITY_QUERY = "INSERT IGNORE INTO guacamole_entity (name, type) VALUES (%s, %s)"
+INSERT_USER_QUERY = (
+    "INSERT INTO guacamole_user (entity_id, password_hash, password_salt, password_date)"
+    " SELECT entity_id, %s, %s, NOW() FROM guacamole_entity WHERE type = 'USER' AND name = %s"
+)
+INSERT_USER_GROUP_QUERY = (
+    "INSERT IGNORE INTO guacamole_user_group (entity_id)"
+    " SELECT entity_id FROM guacamole_entity WHERE type = 'USER_GROUP' AND name = %s"
+)
+INSERT_USER_GROUP_MEMBER_QUERY = (
+    "INSERT IGNORE INTO guacamole_user_group_member (user_group_id, member_entity_id)"
+    " SELECT g.user_group_id, e.entity_id FROM guacamole_user_group g"
+    " JOIN guacamole_entity ge ON ge.entity_id = g.entity_id, guacamole_entity e"
+    " WHERE ge.type = 'USER_GROUP' AND ge.name = %s AND e.type = 'USER' AND e.name = %s"
+)
+
+SELECT_CONNECTION_GROUPS_QUERY = (
+    "SELECT connection_group_id, connection_group_name, type, max_connections,"
+    " max_connections_per_user, enable_session_affinity FROM guacamole_connection_group"
+    " WHERE parent_id IS NULL AND connection_group_name IN ({})"
+)
+INSERT_CONNECTION_GROUP_QUERY = (
+    "INSERT INTO guacamole_connection_group (connection_group_name, type, max_connections,"
+    " max_connections_per_user, enable_session_affinity) VALUES (%s, %s, %s, %s, %s)"
+)
+UPDATE_CONNECTION_GROUP_QUERY = (
+    "UPDATE guacamole_connection_group SET type = %s, max_connections = %s,"
+    " max_connections_per_user = %s, enable_session_affinity = %s"
+    " WHERE connection_group_id = %s"
+)
+SELECT_GROUP_MEMBERS_QUERY = (
+    "SELECT connection_id, connection_name, parent_id, max_connections,"
+    " max_connections_per_user, connection_weight, failover_only FROM guacamole_connection"
+    " WHERE connection_name IN ({}) AND (parent_id IS NULL OR parent_id IN ({}))"
+)
+UPDATE_GROUP_MEMBER_QUERY = (
+    "UPDATE guacamole_connection SET parent_id = %s, max_connections = %s,"
+    " max_connections_per_user = %s, connection_weight = %s, failover_only = %s"
+    " WHERE connection_id = %s"
+)
+CONNECTION_GROUP_COLUMNS = [
+    "type",
+    "max_connections",
+    "max_connections_per_user",
+    "enable_session_affinity",
+]
+GROUP_MEMBER_COLUMNS = [
+    "parent_id",
+    "max_connections",
+    "max_connections_per_user",
+    "connection_weight",
+    "failover_only",
+]
+
+
+def hash_password(password: str, salt: bytes) -> bytes:
+    """Hash a password the way Guacamole does: SHA-256 of the password and the hex salt."""
+    return hashlib.sha256(f"{password}{salt.hex().upper()}".encode()).digest()
+
+
+def salt_and_hash_password(password: str) -> tuple:
+    """Generate a random salt for a password, and return the password hash and the salt."""
+    salt = secrets.token_bytes(32)
+    return hash_password(password, salt), salt
+
+
+def batches(iterable: Iterable, batch_size: int) -> Iterator[List]:
+    """Split an iterable in lists of batch_size elements, consuming it lazily."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+class RestoreError(Exception):
+    """A statement of a backup failed, after the previous ones were committed."""
+
+    def __init__(self, statement: int, rows: int, error: MySQLError):
+        super().__init__(
+            f"statement {statement} failed, after {statement - 1} statements and {rows} rows"
+            f" were restored: {error}"
+        )
+        self.statement = statement
+        self.rows = rows
+
 
 class MysqlRequires(Object):
     """Requires side of a Mysql Endpoint."""
@@ -106,6 +275,373 @@ class Mysql:
             logger.error(f"SQL syntax error in :{query}")
             raise exception
 
+    def prune_history(self, retention_days: int, batch_size: int) -> int:
+        """Delete connection history entries older than the retention period.
+
+        Rows are deleted in primary key order, batch_size rows at a time, committing after
+        every batch so that locks are never held for longer than a single batch.
+
+        Args:
+            retention_days: number of days of history to keep.
+            batch_size: maximum number of rows deleted per transaction.
+
+        Returns:
+            The number of deleted rows.
+        """
+        deleted = 0
+        with self._connection:
+            with self._connection.cursor() as cursor:
+                cursor.execute(HISTORY_CUTOFF_QUERY, (retention_days,))
+                cutoff = cursor.fetchone()["cutoff"]
+                while True:
+                    cursor.execute(PRUNE_HISTORY_QUERY, (cutoff, batch_size))
+                    self._connection.commit()
+                    deleted += cursor.rowcount
+                    if cursor.rowcount < batch_size:
+                        break
+        return deleted
+
+    def session_stats(self, window_hours: int, guacd_hostname: str, limit: int) -> dict:
+        """Get the active sessions, and the peak of concurrent sessions in a time window.
+
+        Args:
+            window_hours: hours of history used to compute the peak of concurrent sessions.
+            guacd_hostname: guacd hostname of the connections without a specific guacd.
+            limit: maximum number of connections, users and guacd hosts reported.
+
+        Returns:
+            The total of active sessions, the active sessions per connection, user and guacd
+            host (the busiest ones, up to the limit), and the peak of concurrent sessions.
+        """
+        with self._connection:
+            with self._connection.cursor() as cursor:
+                cursor.execute(ACTIVE_SESSIONS_QUERY)
+                stats = {"active": cursor.fetchone()["sessions"]}
+                for key, query, args in [
+                    ("connections", ACTIVE_SESSIONS_BY_CONNECTION_QUERY, (limit,)),
+                    ("users", ACTIVE_SESSIONS_BY_USER_QUERY, (limit,)),
+                    ("guacd", ACTIVE_SESSIONS_BY_GUACD_QUERY, (guacd_hostname, limit)),
+                ]:
+                    cursor.execute(query, args)
+                    stats[key] = {row["name"]: row["sessions"] for row in cursor.fetchall()}
+                cursor.execute(SESSION_STATS_SINCE_QUERY, (window_hours,))
+                since = cursor.fetchone()["since"]
+                cursor.execute(PEAK_CONCURRENT_SESSIONS_QUERY, {"since": since})
+                stats["peak"] = int(cursor.fetchone()["peak"])
+        stats["window-hours"] = window_hours
+        return stats
+
+    def import_connections(self, connections: Iterable[dict], batch_size: int) -> dict:
+        """Create or update connections, with their parameters and READ permissions.
+
+        Connections are identified by name, in the root group and in its balancing groups, so
+        the connections moved by sync_balancing_groups are updated where they are, and new ones
+        are created in the root group. They are imported in batches: each batch is written with
+        a few multi-row statements and committed in its own transaction. The parameters of
+        existing connections are replaced by the imported ones, and their connection limit is
+        kept when the import does not set it, like the ones of sync_balancing_groups.
+
+        Args:
+            connections: connections as returned by payload.iter_connections.
+            batch_size: maximum number of connections written per transaction.
+
+        Returns:
+            The number of created and updated connections.
+        """
+        results = {"created": 0, "updated": 0}
+        with self._connection:
+            with self._connection.cursor() as cursor:
+                for batch in batches(connections, batch_size):
+                    connections_by_name = {connection["name"]: connection for connection in batch}
+                    existing_ids = self._get_connection_ids(cursor, connections_by_name)
+                    cursor.executemany(
+                        UPDATE_CONNECTION_QUERY,
+                        [
+                            (c["protocol"], c["max-connections"], existing_ids[name])
+                            for name, c in connections_by_name.items()
+                            if name in existing_ids
+                        ],
+                    )
+                    cursor.executemany(
+                        INSERT_CONNECTION_QUERY,
+                        [
+                            (name, c["protocol"], c["max-connections"])
+                            for name, c in connections_by_name.items()
+                            if name not in existing_ids
+                        ],
+                    )
+                    connection_ids = self._get_connection_ids(cursor, connections_by_name)
+                    if existing_ids:
+                        cursor.execute(
+                            DELETE_CONNECTION_PARAMETERS_QUERY.format(_placeholders(existing_ids)),
+                            list(existing_ids.values()),
+                        )
+                    cursor.executemany(
+                        INSERT_CONNECTION_PARAMETER_QUERY,
+                        [
+                            (connection_ids[name], parameter, value)
+                            for name, c in connections_by_name.items()
+                            for parameter, value in c["parameters"].items()
+                        ],
+                    )
+                    cursor.executemany(
+                        INSERT_CONNECTION_PERMISSION_QUERY,
+                        [
+                            (connection_ids[name], entity_type, entity)
+                            for name, c in connections_by_name.items()
+                            for entity_type, key in (("USER", "users"), ("USER_GROUP", "groups"))
+                            for entity in c[key]
+                        ],
+                    )
+                    self._connection.commit()
+                    results["updated"] += len(existing_ids)
+                    results["created"] += len(connections_by_name) - len(existing_ids)
+        return results
+
+    def provision_users(self, users: Iterable[dict], batch_size: int, workers: int) -> dict:
+        """Create users, and their groups and group memberships.
+
+        Users are written in batches, each committed in its own transaction. Users that already
+        exist keep their password, but are added to the groups they are provisioned with.
+
+        Args:
+            users: users as returned by payload.iter_users.
+            batch_size: maximum number of users written per transaction.
+            workers: number of processes used to hash the passwords. With 0, passwords are
+                hashed in the current process.
+
+        Returns:
+            The number of created and skipped (already existing) users.
+        """
+        results = {"created": 0, "skipped": 0}
+        executor = ProcessPoolExecutor(max_workers=workers) if workers else None
+        try:
+            with self._connection:
+                with self._connection.cursor() as cursor:
+                    for batch in batches(users, batch_size):
+                        created = self._provision_users_batch(cursor, batch, executor, workers)
+                        self._connection.commit()
+                        results["created"] += created
+                        results["skipped"] += len(batch) - created
+        finally:
+            if executor:
+                executor.shutdown()
+        return results
+
+    def _provision_users_batch(self, cursor, users: List[dict], executor, workers: int) -> int:
+        users_by_name = {user["username"]: user for user in users}
+        cursor.execute(
+            SELECT_EXISTING_USERS_QUERY.format(_placeholders(users_by_name)), list(users_by_name)
+        )
+        existing = {row["name"] for row in cursor.fetchall()}
+        new_users = [name for name in users_by_name if name not in existing]
+        passwords = [users_by_name[name]["password"] for name in new_users]
+        if executor:
+            chunksize = max(1, len(passwords) // (workers * 4))
+            hashes = executor.map(salt_and_hash_password, passwords, chunksize=chunksize)
+        else:
+            hashes = map(salt_and_hash_password, passwords)
+        cursor.executemany(INSERT_ENTITY_QUERY, [(name, "USER") for name in new_users])
+        cursor.executemany(
+            INSERT_USER_QUERY,
+            [
+                (password_hash, salt, name)
+                for name, (password_hash, salt) in zip(new_users, hashes)
+            ],
+        )
+        groups = {group for user in users for group in user["groups"]}
+        cursor.executemany(INSERT_ENTITY_QUERY, [(group, "USER_GROUP") for group in groups])
+        cursor.executemany(INSERT_USER_GROUP_QUERY, [(group,) for group in groups])
+        cursor.executemany(
+            INSERT_USER_GROUP_MEMBER_QUERY,
+            [(group, name) for name, user in users_by_name.items() for group in user["groups"]],
+        )
+        return len(new_users)
+
+    def sync_balancing_groups(self, groups: Iterable[dict]) -> dict:
+        """Create or update balancing connection groups and their member connections.
+
+        The existing groups and connections are read first, and only the rows that differ from
+        the desired state are written, in a single transaction. Member connections are looked
+        up by name in the root group and in the synced groups, and moved into their group.
+
+        Args:
+            groups: groups as returned by payload.iter_balancing_groups.
+
+        Returns:
+            The number of created and updated groups, updated and unchanged connections, and
+            the names of the connections that were not found.
+        """
+        groups_by_name = {group["name"]: group for group in groups}
+        if not groups_by_name:
+            return {}
+        with self._connection:
+            with self._connection.cursor() as cursor:
+                results = self._sync_connection_groups(cursor, groups_by_name)
+                results.update(self._sync_group_members(cursor, groups_by_name))
+                self._connection.commit()
+        return results
+
+    def _sync_connection_groups(self, cursor, groups_by_name: dict) -> dict:
+        existing = self._get_connection_groups(cursor, groups_by_name)
+        desired = {
+            name: {
+                "type": "BALANCING",
+                "max_connections": group["max-connections"],
+                "max_connections_per_user": group["max-connections-per-user"],
+                "enable_session_affinity": int(group["enable-session-affinity"]),
+            }
+            for name, group in groups_by_name.items()
+        }
+        created = [name for name in desired if name not in existing]
+        updated = [
+            name
+            for name in desired
+            if name in existing and _diff(existing[name], desired[name], CONNECTION_GROUP_COLUMNS)
+        ]
+        cursor.executemany(
+            INSERT_CONNECTION_GROUP_QUERY,
+            [(name, *_values(desired[name], CONNECTION_GROUP_COLUMNS)) for name in created],
+        )
+        cursor.executemany(
+            UPDATE_CONNECTION_GROUP_QUERY,
+            [
+                (
+                    *_values(desired[name], CONNECTION_GROUP_COLUMNS),
+                    existing[name]["connection_group_id"],
+                )
+                for name in updated
+            ],
+        )
+        return {"groups-created": len(created), "groups-updated": len(updated)}
+
+    def _sync_group_members(self, cursor, groups_by_name: dict) -> dict:
+        group_ids = {
+            name: row["connection_group_id"]
+            for name, row in self._get_connection_groups(cursor, groups_by_name).items()
+        }
+        desired = {
+            connection["name"]: {
+                "parent_id": group_ids[name],
+                "max_connections": connection["max-connections"],
+                "max_connections_per_user": connection["max-connections-per-user"],
+                "connection_weight": connection["weight"],
+                "failover_only": int(connection["failover-only"]),
+            }
+            for name, group in groups_by_name.items()
+            for connection in group["connections"]
+        }
+        existing = {}
+        if desired:
+            cursor.execute(
+                SELECT_GROUP_MEMBERS_QUERY.format(
+                    _placeholders(desired), _placeholders(group_ids)
+                ),
+                [*desired, *group_ids.values()],
+            )
+            for row in cursor.fetchall():
+                name = row["connection_name"]
+                if name not in existing or row["parent_id"] == desired[name]["parent_id"]:
+                    existing[name] = row
+        updated = [
+            name
+            for name in desired
+            if name in existing and _diff(existing[name], desired[name], GROUP_MEMBER_COLUMNS)
+        ]
+        cursor.executemany(
+            UPDATE_GROUP_MEMBER_QUERY,
+            [
+                (*_values(desired[name], GROUP_MEMBER_COLUMNS), existing[name]["connection_id"])
+                for name in updated
+            ],
+        )
+        return {
+            "connections-updated": len(updated),
+            "connections-unchanged": len(existing) - len(updated),
+            "connections-missing": ", ".join(name for name in desired if name not in existing),
+        }
+
+    def _get_connection_groups(self, cursor, names: Iterable[str]) -> dict:
+        names = list(names)
+        cursor.execute(SELECT_CONNECTION_GROUPS_QUERY.format(_placeholders(names)), names)
+        return {row["connection_group_name"]: row for row in cursor.fetchall()}
+
+    def _get_connection_ids(self, cursor, names: Iterable[str]) -> dict:
+        names = list(names)
+        cursor.execute(SELECT_CONNECTION_IDS_QUERY.format(_placeholders(names)), names)
+        return {row["connection_name"]: row["connection_id"] for row in cursor.fetchall()}
+
+    def backup(self, writer: BackupWriter, batch_size: int) -> dict:
+        """Write the schema and rows of every table as SQL statements.
+
+        The tables are read in a consistent snapshot, and their rows are streamed with a
+        server-side cursor, so that they are never all in memory. Rows are written in INSERT
+        statements of batch_size rows.
+
+        Returns:
+            The number of tables and rows written.
+        """
+        tables = rows = 0
+        with self._connection:
+            with self._connection.cursor() as cursor:
+                cursor.execute(BACKUP_SNAPSHOT_QUERY)
+                cursor.execute(BACKUP_TABLES_QUERY)
+                names = [list(row.values())[0] for row in cursor.fetchall()]
+            writer.write("SET FOREIGN_KEY_CHECKS=0;")
+            for name in names:
+                rows += self._backup_table(writer, name, batch_size)
+                tables += 1
+            writer.write("SET FOREIGN_KEY_CHECKS=1;")
+            self._connection.commit()
+        return {"tables": tables, "rows": rows}
+
+    def _backup_table(self, writer: BackupWriter, table: str, batch_size: int) -> int:
+        rows = 0
+        with self._connection.cursor() as cursor:
+            cursor.execute(f"SHOW CREATE TABLE `{table}`")
+            create_table = cursor.fetchone()["Create Table"]
+        writer.write(f"DROP TABLE IF EXISTS `{table}`;")
+        writer.write(f"{create_table};")
+        with self._connection.cursor(pymysql.cursors.SSCursor) as cursor:
+            cursor.execute(f"SELECT * FROM `{table}`")
+            columns = ", ".join(f"`{column[0]}`" for column in cursor.description)
+            for batch in batches(cursor, batch_size):
+                values = ", ".join(
+                    f"({', '.join(self._literal(value) for value in row)})" for row in batch
+                )
+                writer.write(f"INSERT INTO `{table}` ({columns}) VALUES {values};")
+                rows += len(batch)
+        return rows
+
+    def restore(self, statements: Iterable[str]) -> dict:
+        """Execute the statements of a backup, committing after every statement.
+
+        Returns:
+            The number of statements executed and rows inserted.
+
+        Raises:
+            RestoreError: if a statement fails, with the statements executed until then.
+        """
+        executed = rows = 0
+        with self._connection:
+            with self._connection.cursor() as cursor:
+                for statement in statements:
+                    try:
+                        cursor.execute(statement)
+                    except MySQLError as e:
+                        raise RestoreError(executed + 1, rows, e) from e
+                    self._connection.commit()
+                    executed += 1
+                    if statement.startswith("INSERT"):
+                        rows += cursor.rowcount
+        return {"statements": executed, "rows": rows}
+
+    def _literal(self, value) -> str:
+        # Hexadecimal literals keep binary values, like password hashes, printable
+        if isinstance(value, (bytes, bytearray)):
+            return f"X'{value.hex()}'"
+        return self._connection.escape(value)
+
     def _load_queries(self, sql: str):
         sql_without_comments = ""
         for line in sql.splitlines():
@@ -126,3 +662,15 @@ class Mysql:
 
     def _empty_string(self, string):
         return not string or all(s == " " or s == "\n" for s in string)
+
+
+def _placeholders(values) -> str:
+    return ", ".join(["%s"] * len(values))
+
+
+def _values(row: dict, columns: List[str]) -> tuple:
+    return tuple(row[column] for column in columns)
+
+
+def _diff(existing: dict, desired: dict, columns: List[str]) -> bool:
+    return _values(existing, columns) != _values(desired, columns)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Module that includes functions to parse the payloads of the charm actions."""
+
+import csv
+import io
+from typing import Iterator
+
+import yaml
+
+LIST_SEPARATOR = ";"
+CONNECTION_FIELDS = ["name", "protocol", "users", "groups", "max-connections"]
+
+
+def iter_records(payload: str, payload_format: str) -> Iterator[dict]:
+    """Iterate over the records of a csv or yaml payload without loading all of them at once.
+
+    Args:
+        payload: csv text with a header row, or a yaml document stream. Each yaml document can
+            be a single record, or a list of records, which are parsed one at a time.
+        payload_format: "csv" or "yaml".
+
+    Raises:
+        ValueError: if the format is not supported or a record is not a mapping.
+    """
+    if payload_format == "csv":
+        yield from csv.DictReader(io.StringIO(payload.strip()))
+    elif payload_format == "yaml":
+        for record in _iter_yaml_records(payload):
+            if not isinstance(record, dict):
+                raise ValueError(f"invalid record: {record}")
+            yield record
+    else:
+        raise ValueError(f"unsupported format: {payload_format}")
+
+
+def _iter_yaml_records(payload: str) -> Iterator:
+    # The items of a top-level list are composed and constructed one at a time, from the parser
+    # events, instead of constructing the whole list of every document.
+    loader = yaml.SafeLoader(payload)
+    try:
+        loader.get_event()  # StreamStartEvent
+        while not loader.check_event(yaml.StreamEndEvent):
+            loader.get_event()  # DocumentStartEvent
+            if loader.check_event(yaml.SequenceStartEvent):
+                loader.get_event()
+                while not loader.check_event(yaml.SequenceEndEvent):
+                    yield loader.construct_document(loader.compose_node(None, None))
+                loader.get_event()
+            else:
+                yield loader.construct_document(loader.compose_node(None, None))
+            loader.get_event()  # DocumentEndEvent
+            loader.anchors = {}
+    finally:
+        loader.dispose()
+
+
+def iter_connections(payload: str, payload_format: str) -> Iterator[dict]:
+    """Iterate over the normalized connections of an import-connections payload.
+
+    In csv payloads, every column which is not a connection field is a connection parameter,
+    and users and groups are separated by semicolons.
+
+    Raises:
+        ValueError: if a connection has no name or protocol.
+    """
+    for record in iter_records(payload, payload_format):
+        if payload_format == "csv":
+            record = {
+                **{field: record.pop(field, None) for field in CONNECTION_FIELDS},
+                "parameters": {key: value for key, value in record.items() if value},
+            }
+        if not record.get("name") or not record.get("protocol"):
+            raise ValueError(f"connection without name or protocol: {record}")
+        yield {
+            "name": str(record["name"]),
+            "protocol": str(record["protocol"]),
+            "parameters": {
+                str(key): str(value) for key, value in (record.get("parameters") or {}).items()
+            },
+            "users": _as_list(record.get("users")),
+            "groups": _as_list(record.get("groups")),
+            "max-connections": _as_int(record.get("max-connections")),
+        }
+
+
+def iter_users(payload: str, payload_format: str) -> Iterator[dict]:
+    """Iterate over the normalized users of a provision-users payload.
+
+    In csv payloads, groups are separated by semicolons.
+
+    Raises:
+        ValueError: if a user has no username or password.
+    """
+    for record in iter_records(payload, payload_format):
+        if not record.get("username") or not record.get("password"):
+            raise ValueError(f"user without username or password: {record.get('username')}")
+        yield {
+            "username": str(record["username"]),
+            "password": str(record["password"]),
+            "groups": _as_list(record.get("groups")),
+        }
+
+
+def iter_balancing_groups(payload: str) -> Iterator[dict]:
+    """Iterate over the normalized groups of a yaml sync-balancing-groups payload.
+
+    Raises:
+        ValueError: if a group or one of its connections has no name.
+    """
+    for record in iter_records(payload, "yaml"):
+        connections = record.get("connections") or []
+        if not record.get("name") or not all(c.get("name") for c in connections):
+            raise ValueError(f"group or connection without name: {record}")
+        yield {
+            "name": str(record["name"]),
+            "max-connections": _as_int(record.get("max-connections")),
+            "max-connections-per-user": _as_int(record.get("max-connections-per-user")),
+            "enable-session-affinity": bool(record.get("enable-session-affinity")),
+            "connections": [
+                {
+                    "name": str(connection["name"]),
+                    "max-connections": _as_int(connection.get("max-connections")),
+                    "max-connections-per-user": _as_int(
+                        connection.get("max-connections-per-user")
+                    ),
+                    "weight": _as_int(connection.get("weight")),
+                    "failover-only": bool(connection.get("failover-only")),
+                }
+                for connection in connections
+            ],
+        }
+
+
+def _as_list(value) -> list:
+    if not value:
+        return []
+    if isinstance(value, str):
+        return [item.strip() for item in value.split(LIST_SEPARATOR) if item.strip()]
+    return [str(item) for item in value]
+
+
+def _as_int(value):
+    return int(value) if value not in (None, "") else None
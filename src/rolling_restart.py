@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Module to restart the units of an application one at a time."""
+
+import logging
+import uuid
+from typing import Callable
+
+import ops.charm
+from ops.framework import Object
+from ops.model import Relation
+
+logger = logging.getLogger(__name__)
+
+
+class RollingRestart(Object):
+    """Leader-coordinated rolling restarts through a peer relation.
+
+    Units that need a restart publish a restart request in their unit data. The leader grants
+    the restart turn to one unit at a time through the application data, and only grants the
+    next turn when the unit holding it acknowledges that it restarted and passed its health
+    check. The restart callback must return whether the restarted unit is healthy.
+    """
+
+    def __init__(
+        self,
+        charm: ops.charm.CharmBase,
+        restart_callback: Callable[[], bool],
+        relation_name: str = "cluster",
+    ):
+        super().__init__(charm, relation_name)
+        self.relation_name = relation_name
+        self._restart_callback = restart_callback
+        self.framework.observe(charm.on[relation_name].relation_changed, self._on_relation_changed)
+        self.framework.observe(
+            charm.on[relation_name].relation_departed, self._on_relation_changed
+        )
+        self.framework.observe(charm.on.leader_elected, self._on_relation_changed)
+
+    @property
+    def relation(self) -> Relation:
+        """Peer relation."""
+        return self.model.get_relation(self.relation_name)
+
+    def request(self) -> bool:
+        """Request a restart of this unit.
+
+        The unit is restarted right away if it has no peers.
+
+        Returns:
+            True if the unit has been restarted, healthy or not, False if it is waiting for its
+            turn. The restart callback reports the health of the restarted unit.
+        """
+        relation = self.relation
+        if not relation or not relation.units:
+            self._restart_callback()
+            return True
+        relation.data[self.model.unit]["restart-request"] = uuid.uuid4().hex
+        logger.info("restart requested, waiting for turn")
+        if self.model.unit.is_leader() and self._grant_turn(relation):
+            return True
+        return not self._is_pending(relation.data[self.model.unit])
+
+    def _on_relation_changed(self, _):
+        relation = self.relation
+        if not relation:
+            return
+        if self.model.unit.is_leader():
+            self._grant_turn(relation)
+        else:
+            self._take_turn(relation)
+
+    def _take_turn(self, relation: Relation) -> bool:
+        app_data = relation.data[self.model.app]
+        unit_data = relation.data[self.model.unit]
+        if (
+            app_data.get("restart-unit") != self.model.unit.name
+            or app_data.get("restart-nonce") != unit_data.get("restart-request")
+            or not self._is_pending(unit_data)
+        ):
+            return False
+        logger.info("restart turn granted")
+        if self._restart_callback():
+            unit_data["restart-done"] = unit_data["restart-request"]
+        else:
+            logger.warning("unit unhealthy after restart, holding the rolling restart")
+        return True
+
+    def _grant_turn(self, relation: Relation) -> bool:
+        """Grant the restart turn to the next unit, and take it if it is this one.
+
+        Returns:
+            True if this unit took its turn.
+        """
+        app_data = relation.data[self.model.app]
+        units = {unit.name: relation.data[unit] for unit in relation.units}
+        units[self.model.unit.name] = relation.data[self.model.unit]
+        current = app_data.get("restart-unit")
+        if (
+            current in units
+            and app_data.get("restart-nonce") == units[current].get("restart-request")
+            and self._is_pending(units[current])
+        ):
+            return False
+        pending = sorted(name for name, data in units.items() if self._is_pending(data))
+        if not pending:
+            app_data.update({"restart-unit": "", "restart-nonce": ""})
+            return False
+        app_data.update(
+            {"restart-unit": pending[0], "restart-nonce": units[pending[0]]["restart-request"]}
+        )
+        logger.info(f"restart turn granted to {pending[0]}")
+        if pending[0] != self.model.unit.name or not self._take_turn(relation):
+            return False
+        self._grant_turn(relation)
+        return True
+
+    @staticmethod
+    def _is_pending(unit_data) -> bool:
+        return unit_data.get("restart-request", "") != unit_data.get("restart-done", "")
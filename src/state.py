@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Module to persist the charm state with as few hook tool calls as possible."""
+
+import logging
+import shutil
+import subprocess
+import typing
+
+import ops.main
+import ops.storage
+import yaml
+from ops.charm import CharmBase
+
+logger = logging.getLogger(__name__)
+
+_ABSENT = object()
+_Loader = ops.storage._SimpleLoader
+
+
+class BatchedJujuStorageBackend(ops.storage._JujuStorageBackend):
+    """Juju state backend which keeps the changes in memory until they are flushed.
+
+    It extends private classes of ops, which is pinned in requirements.txt to the version they
+    are written for.
+
+    Every key is read from Juju at most once. Values that are set and deleted before a flush
+    (like the snapshots and notices of the events emitted during a hook) never reach Juju, and
+    the values that changed are written with a single state-set call.
+
+    ops changes the values it gets in place, like the list of notices, so the values are
+    compared with the yaml they had in Juju, not with the objects that were read.
+    """
+
+    def __init__(self):
+        # Yaml of the values in Juju, or _ABSENT, by key
+        self._original = {}
+        # Current values, or _ABSENT, of the keys read or written since the last flush
+        self._values = {}
+
+    def get(self, key: str) -> typing.Any:
+        """Get the value of a key, reading it from Juju only the first time."""
+        if key not in self._values:
+            self._values[key] = self._load(key)
+        value = self._values[key]
+        if value is _ABSENT:
+            raise KeyError(key)
+        return value
+
+    def set(self, key: str, value: typing.Any) -> None:
+        """Set the value of a key, until the next flush."""
+        self._values[key] = value
+
+    def delete(self, key: str) -> None:
+        """Delete a key, until the next flush."""
+        if key not in self._original and key in self._values:
+            # Keys written before being read, like the snapshots of new events, are new
+            self._original[key] = _ABSENT
+        self._values[key] = _ABSENT
+
+    def flush(self) -> None:
+        """Write the changed values to Juju."""
+        current = {
+            key: _ABSENT if value is _ABSENT else _dump(value)
+            for key, value in self._values.items()
+        }
+        changed = {
+            key: self._values[key]
+            for key, dumped in current.items()
+            if dumped is not _ABSENT and dumped != self._original.get(key, _ABSENT)
+        }
+        deleted = [
+            key
+            for key, dumped in current.items()
+            if dumped is _ABSENT and self._original.get(key) is not _ABSENT
+        ]
+        if changed:
+            self._set_many(changed)
+        for key in deleted:
+            super().delete(key)
+        self._original.update(current)
+        self._values = {}
+        logger.debug(f"charm state flushed: {len(changed)} keys set, {len(deleted)} deleted")
+
+    def _load(self, key: str) -> typing.Any:
+        """Read the value of a key from Juju, keeping its yaml to find its changes."""
+        if key in self._original:
+            dumped = self._original[key]
+            return dumped if dumped is _ABSENT else yaml.load(dumped, Loader=_Loader)
+        try:
+            value = super().get(key)
+        except KeyError:
+            self._original[key] = _ABSENT
+            return _ABSENT
+        self._original[key] = _dump(value)
+        return value
+
+    def _set_many(self, values: dict) -> None:
+        content = yaml.dump(
+            {key: _dump(value) for key, value in values.items()},
+            encoding="utf8",
+            default_style="|",
+            default_flow_style=False,
+            Dumper=ops.storage._SimpleDumper,
+        )
+        subprocess.run([shutil.which("state-set"), "--file", "-"], input=content, check=True)
+
+
+def _dump(value: typing.Any) -> str:
+    return yaml.dump(value, Dumper=ops.storage._SimpleDumper, default_flow_style=None)
+
+
+class BatchedJujuStorage(ops.storage.JujuStorage):
+    """Juju storage which writes all the state changes of a hook when the framework commits."""
+
+    def __init__(self, backend: BatchedJujuStorageBackend = None):
+        super().__init__(backend or BatchedJujuStorageBackend())
+
+    def commit(self):
+        """Write the state changes to Juju."""
+        self._backend.flush()
+
+
+def main(charm_class: typing.Type[CharmBase], use_juju_for_storage: bool = True):
+    """Run the charm, storing its state in the controller, in batches, or in the local disk.
+
+    The local storage is in the charm directory, which does not survive the pod, so it only
+    fits charms that can rebuild their state from their relations. The storage is selected in
+    code, not in the config, as switching it at runtime would split the state between the two.
+    """
+    juju_storage = ops.storage.JujuStorage
+    ops.storage.JujuStorage = BatchedJujuStorage
+    try:
+        ops.main.main(charm_class, use_juju_for_storage=use_juju_for_storage)
+    finally:
+        ops.storage.JujuStorage = juju_storage
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Module to configure the Tomcat server in the guacamole container."""
+
+import logging
+import re
+from typing import Callable
+from xml.etree import ElementTree  # nosec: server.xml comes from the image
+
+from ops.model import Container
+from ops.pebble import ExecError
+
+logger = logging.getLogger(__name__)
+
+CATALINA_HOME = "/usr/local/tomcat"
+ORIGINAL_SUFFIX = ".charm-original"
+ACCESS_LOG_VALVE = "org.apache.catalina.valves.AccessLogValve"
+ACCESS_LOG_MODES = ("off", "buffered", "unbuffered")
+# java.util.logging levels of the Guacamole (logback) log levels
+JULI_LEVELS = {
+    "error": "SEVERE",
+    "warn": "WARNING",
+    "info": "INFO",
+    "debug": "FINE",
+    "trace": "FINEST",
+}
+# The root logger, and the handler writing the Catalina logs to stdout
+JULI_LEVEL_PROPERTIES = (".level", "java.util.logging.ConsoleHandler.level")
+DEFAULT_SERVLET_CLASS = (
+    "<servlet-class>org.apache.catalina.servlets.DefaultServlet</servlet-class>"
+)
+# The bundles of the web client are versioned: index.html requests them with the build
+# identifier in the query string, so a new Guacamole version is fetched again.
+CACHED_CONTENT_TYPES = ("text/css", "application/javascript", "text/javascript")
+# The DefaultServlet serves the variant of a file with one of these extensions, when it exists
+# and the client accepts its encoding, in this order of preference.
+PRECOMPRESSED_ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+PRECOMPRESSED_FILES = ("*.js", "*.css", "*.html", "*.svg", "*.json")
+# Compresses the files of the exploded webapp that do not have an up to date variant yet.
+# Brotli variants are only written when the image has the brotli command.
+PRECOMPRESS_SCRIPT = """
+find "$1" -type f -size +1k \\( {patterns} \\) | while read -r file; do
+    [ "$file.gz" -nt "$file" ] || gzip -9 -k -f "$file" || exit 1
+    if command -v brotli > /dev/null; then
+        [ "$file.br" -nt "$file" ] || brotli -q 11 -k -f "$file" || exit 1
+    fi
+done
+"""
+
+
+class TomcatServer:
+    """Tomcat configuration files in CATALINA_HOME/conf, edited by the charm.
+
+    The edits are always applied to the file of the image, which is kept the first time the
+    file is edited, so the settings removed from the config are restored. The files are only
+    written when their content changes.
+    """
+
+    def __init__(self, container: Container, catalina_home: str = CATALINA_HOME):
+        self.container = container
+        self.catalina_home = catalina_home
+
+    def configure_access_log(self, mode: str) -> bool:
+        """Turn off the access log valve of every host, or set whether it is buffered.
+
+        Returns:
+            True if server.xml has been written, False if it was up to date.
+
+        Raises:
+            ValueError: if the access log mode is not valid.
+        """
+        if not self._edit("server.xml", lambda original: render_access_log(original, mode)):
+            return False
+        logger.info(f"server.xml access log set to {mode}")
+        return True
+
+    def configure_log_level(self, level: str) -> bool:
+        """Set the level of the Tomcat (JULI) logs, like the level of the Guacamole logs.
+
+        Returns:
+            True if logging.properties has been written, False if it was up to date.
+
+        Raises:
+            ValueError: if the log level is not valid.
+        """
+        if not self._edit(
+            "logging.properties", lambda original: render_logging_properties(original, level)
+        ):
+            return False
+        logger.info(f"logging.properties level set to {level}")
+        return True
+
+    def configure_static_assets(self, max_age_days: int, precompressed: bool) -> bool:
+        """Set the cache headers of the web client bundles, and serve pre-compressed files.
+
+        The settings of conf/web.xml are the defaults of every webapp, Guacamole included.
+
+        Returns:
+            True if web.xml has been written, False if it was up to date.
+
+        Raises:
+            ValueError: if the maximum age is negative.
+        """
+        if not self._edit(
+            "web.xml", lambda original: render_static_assets(original, max_age_days, precompressed)
+        ):
+            return False
+        logger.info(
+            f"web.xml static assets max age set to {max_age_days} days"
+            f" (pre-compressed: {'on' if precompressed else 'off'})"
+        )
+        return True
+
+    def precompress_webapp(self, name: str) -> bool:
+        """Write the compressed variants of the static files of an exploded webapp.
+
+        Tomcat explodes the war of the webapp when it starts, so this is done after it started.
+        The variants already up to date are not compressed again.
+
+        Returns:
+            True if the variants are written, False if the webapp is not exploded or failed.
+        """
+        webapp = f"{self.catalina_home}/webapps/{name}"
+        if not self.container.exists(webapp):
+            logger.warning(f"{webapp} not found, static files not pre-compressed")
+            return False
+        patterns = " -o ".join(f"-name '{pattern}'" for pattern in PRECOMPRESSED_FILES)
+        script = PRECOMPRESS_SCRIPT.format(patterns=patterns)
+        try:
+            self.container.exec(["sh", "-c", script, "sh", webapp]).wait_output()
+        except ExecError as e:
+            logger.warning(f"static files of {webapp} not pre-compressed: {e.stderr}")
+            return False
+        logger.info(f"static files of {webapp} pre-compressed")
+        return True
+
+    def _edit(self, name: str, render: Callable[[str], str]) -> bool:
+        path = f"{self.catalina_home}/conf/{name}"
+        original_path = f"{path}{ORIGINAL_SUFFIX}"
+        if self.container.exists(original_path):
+            original = self.container.pull(original_path).read()
+            current = self.container.pull(path).read()
+        else:
+            original = current = self.container.pull(path).read()
+        content = render(original)
+        if content == current:
+            return False
+        if not self.container.exists(original_path):
+            self.container.push(original_path, original)
+        self.container.push(path, content)
+        return True
+
+
+def render_access_log(server_xml: str, mode: str) -> str:
+    """Render server.xml with the access log valves removed, buffered or unbuffered.
+
+    Buffered valves write the log when their buffer is full, instead of on every request.
+
+    Raises:
+        ValueError: if the access log mode is not valid.
+    """
+    if mode not in ACCESS_LOG_MODES:
+        raise ValueError(f"access-log must be one of {', '.join(ACCESS_LOG_MODES)}: {mode}")
+    parser = ElementTree.XMLParser(target=ElementTree.TreeBuilder(insert_comments=True))
+    server = ElementTree.fromstring(server_xml, parser=parser)  # nosec
+    for host in server.iter("Host"):
+        for valve in host.findall("Valve"):
+            if valve.get("className") != ACCESS_LOG_VALVE:
+                continue
+            if mode == "off":
+                host.remove(valve)
+            else:
+                valve.set("buffered", "true" if mode == "buffered" else "false")
+    # The XML declaration and the comments before the root element are not parsed
+    prolog = server_xml[: server_xml.index(f"<{server.tag}")]
+    return prolog + ElementTree.tostring(server, encoding="unicode") + "\n"
+
+
+def render_logging_properties(logging_properties: str, level: str) -> str:
+    """Render logging.properties with the level of the root logger and console handler set.
+
+    Raises:
+        ValueError: if the log level is not valid.
+    """
+    if level not in JULI_LEVELS:
+        raise ValueError(f"log-level must be one of {', '.join(JULI_LEVELS)}: {level}")
+    for name in JULI_LEVEL_PROPERTIES:
+        line = f"{name} = {JULI_LEVELS[level]}"
+        pattern = re.compile(rf"^{re.escape(name)}\s*=.*$", re.MULTILINE)
+        if pattern.search(logging_properties):
+            logging_properties = pattern.sub(line, logging_properties)
+        else:
+            logging_properties = f"{logging_properties.rstrip()}\n{line}\n"
+    return logging_properties
+
+
+def render_static_assets(web_xml: str, max_age_days: int, precompressed: bool) -> str:
+    """Render web.xml with cache headers for the web client bundles, and pre-compressed files.
+
+    An ExpiresFilter sets the Cache-Control and Expires headers of the responses with the
+    content types of the bundles, and the DefaultServlet serves the pre-compressed variants of
+    the static files instead of compressing them on every request.
+
+    Args:
+        web_xml: web.xml of the image.
+        max_age_days: days the bundles are cached by browsers, 0 to not add cache headers.
+        precompressed: whether the DefaultServlet serves the pre-compressed variants.
+
+    Raises:
+        ValueError: if the maximum age is negative.
+    """
+    if max_age_days < 0:
+        raise ValueError(f"static-assets-max-age must not be negative: {max_age_days}")
+    if precompressed:
+        encodings = ",".join(
+            f"{encoding}={extension}" for encoding, extension in PRECOMPRESSED_ENCODINGS
+        )
+        init_param = _init_param("precompressed", encodings, indent=8)
+        web_xml = web_xml.replace(DEFAULT_SERVLET_CLASS, DEFAULT_SERVLET_CLASS + init_param, 1)
+    if max_age_days:
+        init_params = "".join(
+            _init_param(
+                f"ExpiresByType {content_type}", f"access plus {max_age_days} days", indent=8
+            )
+            for content_type in CACHED_CONTENT_TYPES
+        )
+        expires_filter = f"""
+    <!-- Cache headers of the web client bundles, managed by the charm -->
+    <filter>
+        <filter-name>ExpiresFilter</filter-name>
+        <filter-class>org.apache.catalina.filters.ExpiresFilter</filter-class>{init_params}
+    </filter>
+    <filter-mapping>
+        <filter-name>ExpiresFilter</filter-name>
+        <url-pattern>/*</url-pattern>
+        <dispatcher>REQUEST</dispatcher>
+    </filter-mapping>
+"""
+        end = web_xml.rindex("</web-app>")
+        web_xml = web_xml[:end] + expires_filter.lstrip("\n") + "\n" + web_xml[end:]
+    return web_xml
+
+
+def _init_param(name: str, value: str, indent: int) -> str:
+    spaces = " " * indent
+    return (
+        f"\n{spaces}<init-param>"
+        f"\n{spaces}    <param-name>{name}</param-name>"
+        f"\n{spaces}    <param-value>{value}</param-value>"
+        f"\n{spaces}</init-param>"
+    )
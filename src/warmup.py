@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Module to warm up Guacamole after a restart, before it serves users."""
+
+import logging
+import time
+from typing import List, Optional
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+logger = logging.getLogger(__name__)
+
+REQUEST_TIMEOUT = 5
+
+
+def request_latency(url: str) -> float:
+    """Seconds it takes to get a response from an url, or infinity if there is no response.
+
+    Error responses, like the 403 of an API endpoint called without a token, are responses:
+    serving them warms up the same code paths.
+    """
+    start = time.monotonic()
+    try:
+        with urlopen(url, timeout=REQUEST_TIMEOUT) as response:
+            response.read()
+    except HTTPError:
+        pass
+    except OSError:
+        return float("inf")
+    return time.monotonic() - start
+
+
+def warm_up(
+    base_url: str, paths: List[str], threshold: float, timeout: float, settle_rounds: int = 3
+) -> Optional[float]:
+    """Request some paths in rounds, until the latency settles below a threshold.
+
+    Class loading, JIT compilation and the initialization of the webapp make the first requests
+    slow. The latency is settled when the slowest request of settle_rounds consecutive rounds
+    is faster than the threshold.
+
+    Args:
+        base_url: url the paths are relative to.
+        paths: paths requested in every round.
+        threshold: maximum latency, in seconds, of a settled round.
+        timeout: seconds after which the warm-up stops, settled or not.
+        settle_rounds: consecutive rounds below the threshold needed to settle.
+
+    Returns:
+        The seconds it took to settle, or None if it did not settle before the timeout.
+    """
+    start = time.monotonic()
+    settled_rounds = rounds = 0
+    while time.monotonic() - start < timeout:
+        rounds += 1
+        latency = max(request_latency(f"{base_url}{path}") for path in paths)
+        settled_rounds = settled_rounds + 1 if latency < threshold else 0
+        logger.debug(f"warm-up round {rounds}: slowest request took {latency:.3f}s")
+        if settled_rounds >= settle_rounds:
+            return time.monotonic() - start
+        if latency == float("inf"):
+            time.sleep(1)
+    return None
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Throughput and latency benchmarks of the Mysql class against the MySQL protocol stub.
+
+Run them with `tox -e benchmark`. Every query pays the simulated network latency, so the
+results show the effect of batching on the number of round trips to the database.
+"""
+
+import datetime
+import logging
+import re
+import time
+
+import pytest
+
+from mysql import Mysql
+from tests.mysql_stub import MysqlStubServer, ResultSet
+
+logger = logging.getLogger(__name__)
+
+LATENCY = 0.0005
+QUOTED_STRING = r"'((?:[^'\\]|\\.)*)'"
+
+
+class FakeGuacamoleDatabase:
+    """Handler keeping just enough state to answer the queries of the Mysql class."""
+
+    def __init__(self, history_rows: int = 0):
+        self.connections = {}
+        self.users = set()
+        self.history_rows = history_rows
+
+    def __call__(self, query: str):
+        if query.startswith("SELECT NOW()"):
+            return ResultSet(["cutoff"], [(datetime.datetime.now(),)])
+        if query.startswith("DELETE FROM guacamole_connection_history"):
+            deleted = min(int(query.rsplit("LIMIT", 1)[1]), self.history_rows)
+            self.history_rows -= deleted
+            return deleted
+        if query.startswith("SELECT c.connection_id, c.connection_name"):
+            names = re.findall(QUOTED_STRING, query)
+            rows = [(self.connections[n], n) for n in names if n in self.connections]
+            return ResultSet(["connection_id", "connection_name"], rows)
+        if query.startswith("INSERT INTO guacamole_connection ("):
+            for name in re.findall(r"\(" + QUOTED_STRING, query):
+                self.connections.setdefault(name, len(self.connections) + 1)
+        if query.startswith("SELECT e.name"):
+            names = re.findall(QUOTED_STRING, query)
+            return ResultSet(["name"], [(name,) for name in names if name in self.users])
+        if query.startswith("INSERT IGNORE INTO guacamole_entity"):
+            self.users.update(re.findall(r"\(" + QUOTED_STRING + r", 'USER'\)", query))
+        return 1
+
+
+@pytest.fixture
+def database():
+    database = FakeGuacamoleDatabase(history_rows=20000)
+    with MysqlStubServer(database, latency=LATENCY) as server:
+        yield server, database
+
+
+def _mysql(server: MysqlStubServer) -> Mysql:
+    return Mysql(server.host, server.port, "user", "password", "db")
+
+
+def _report(name: str, count: int, queries: int, elapsed: float, unit: str = "rows"):
+    logger.info(
+        f"{name}: {count} {unit} in {elapsed:.3f}s, {count / elapsed:.0f} {unit}/s,"
+        f" {queries} queries, {1000 * elapsed / queries:.3f} ms/query"
+    )
+
+
+def test_benchmark_schema_init(database):
+    server, _ = database
+    statements = 500
+    sql = "".join(
+        f"CREATE TABLE guacamole_table_{i} (id int NOT NULL, PRIMARY KEY (id));\n"
+        f"-- comment {i}\n"
+        for i in range(statements)
+    )
+    start = time.monotonic()
+    _mysql(server).execute(sql)
+    elapsed = time.monotonic() - start
+    _report("schema init", statements, len(server.queries), elapsed, "statements")
+
+
+@pytest.mark.parametrize("batch_size", [1, 100, 1000])
+def test_benchmark_import_connections(database, batch_size: int):
+    server, database = database
+    connections = (
+        {
+            "name": f"desktop-{i}",
+            "protocol": "rdp",
+            "parameters": {"hostname": f"10.0.{i // 256}.{i % 256}", "port": "3389"},
+            "users": ["alice"],
+            "groups": ["developers"],
+            "max-connections": 2,
+        }
+        for i in range(2000)
+    )
+    start = time.monotonic()
+    results = _mysql(server).import_connections(connections, batch_size)
+    elapsed = time.monotonic() - start
+    assert results == {"created": 2000, "updated": 0}
+    _report(f"import connections (batch {batch_size})", 2000, len(server.queries), elapsed)
+
+
+@pytest.mark.parametrize("batch_size", [10, 500])
+def test_benchmark_provision_users(database, batch_size: int):
+    server, database = database
+    users = (
+        {"username": f"user-{i}", "password": "secret", "groups": ["developers"]}
+        for i in range(1000)
+    )
+    start = time.monotonic()
+    results = _mysql(server).provision_users(users, batch_size, 0)
+    elapsed = time.monotonic() - start
+    assert results == {"created": 1000, "skipped": 0}
+    _report(f"provision users (batch {batch_size})", 1000, len(server.queries), elapsed)
+
+
+@pytest.mark.parametrize("batch_size", [100, 1000, 5000])
+def test_benchmark_prune_history(database, batch_size: int):
+    server, database = database
+    start = time.monotonic()
+    deleted = _mysql(server).prune_history(90, batch_size)
+    elapsed = time.monotonic() - start
+    assert deleted == 20000
+    _report(f"prune history (batch {batch_size})", deleted, len(server.queries), elapsed)
@@ -0,0 +1,12 @@
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import pytest
+
+from tests.mysql_stub import MysqlStubServer
+
+
+@pytest.fixture
+def mysql_stub():
+    with MysqlStubServer() as server:
+        yield server
@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Asyncio load generator for the Guacamole REST API and HTTP tunnel endpoints.
+
+Every worker keeps one HTTP/1.1 connection open, logs in, and then runs a random mix of
+operations until the requests or the duration of the run are exhausted:
+
+- tokens: create an auth token (POST /api/tokens), deleting the previous one.
+- connections: list the connections of the data source.
+- tunnel: open an HTTP tunnel to a random connection, and close it.
+
+Only the requests of the operation itself are timed. Run it against a local stub with
+`tox -e load`, or against a unit with:
+
+    python -m tests.load.guacamole_load --url http://<pod_ip>:8080/guacamole --concurrency 50
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import math
+import random
+import ssl
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple, Union
+from urllib.parse import urlencode, urlsplit
+
+logger = logging.getLogger(__name__)
+
+OPERATIONS = ("tokens", "connections", "tunnel")
+DEFAULT_MIX = {"tokens": 1, "connections": 8, "tunnel": 1}
+
+
+class GuacamoleLoadError(Exception):
+    """Unexpected response from Guacamole."""
+
+
+def parse_mix(mix: str) -> Dict[str, int]:
+    """Parse a request mix like "tokens=1,connections=8,tunnel=1" into weights."""
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        if name.strip() not in OPERATIONS or not weight.strip().isdigit():
+            raise ValueError(f"invalid mix item: {item}")
+        weights[name.strip()] = int(weight)
+    if not any(weights.values()):
+        raise ValueError(f"invalid mix: {mix}")
+    return weights
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Nearest-rank percentile of a list of values, sorted or not."""
+    if not values:
+        return 0.0
+    rank = math.ceil(len(values) * p / 100)
+    return sorted(values)[min(max(rank, 1), len(values)) - 1]
+
+
+@dataclass
+class OperationStats:
+    """Latencies, in seconds, and errors of an operation."""
+
+    latencies: List[float] = field(default_factory=list)
+    errors: int = 0
+
+    def report(self, elapsed: float) -> dict:
+        """Throughput and latency percentiles, in milliseconds."""
+        requests = len(self.latencies) + self.errors
+        return {
+            "requests": requests,
+            "errors": self.errors,
+            "requests-per-second": round(requests / elapsed, 1) if elapsed else requests,
+            **{f"p{p}-ms": round(1000 * percentile(self.latencies, p), 2) for p in (50, 95, 99)},
+        }
+
+
+class GuacamoleClient:
+    """Minimal keep-alive HTTP/1.1 client of a Guacamole unit."""
+
+    def __init__(self, url: str):
+        url = urlsplit(url.rstrip("/"))
+        self._host = url.hostname
+        self._port = url.port or (443 if url.scheme == "https" else 80)
+        self._ssl = ssl.create_default_context() if url.scheme == "https" else None
+        self._base_path = url.path
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self.token = None
+        self.data_source = None
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        body: Union[dict, bytes, None] = None,
+        headers: Optional[dict] = None,
+    ) -> Tuple[int, bytes]:
+        """Send a request, with a form or raw body, and return the status and content.
+
+        A request sent on a kept-alive connection that the server closed while it was idle is
+        sent again on a new connection.
+        """
+        head = {"Host": self._host, **(headers or {})}
+        if isinstance(body, dict):
+            content = urlencode(body).encode()
+            head["Content-Type"] = "application/x-www-form-urlencoded"
+        else:
+            content = body or b""
+        head["Content-Length"] = str(len(content))
+        data = (
+            f"{method} {self._base_path}{path} HTTP/1.1\r\n".encode()
+            + "".join(f"{name}: {value}\r\n" for name, value in head.items()).encode()
+            + b"\r\n"
+            + content
+        )
+        reused = bool(self._writer and not self._writer.is_closing())
+        try:
+            return await self._send(data)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            if not reused:
+                raise
+        logger.debug("kept-alive connection closed by the server, reconnecting")
+        return await self._send(data)
+
+    async def _send(self, data: bytes) -> Tuple[int, bytes]:
+        if not self._writer or self._writer.is_closing():
+            self._reader, self._writer = await asyncio.open_connection(
+                self._host, self._port, ssl=self._ssl
+            )
+        try:
+            self._writer.write(data)
+            return await self._read_response()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            self._writer.close()
+            raise
+
+    async def _read_response(self) -> Tuple[int, bytes]:
+        status_line = await self._reader.readline()
+        if not status_line:
+            raise ConnectionError("connection closed by the server")
+        try:
+            status = int(status_line.split(b" ", 2)[1])
+        except (IndexError, ValueError):
+            raise GuacamoleLoadError(f"invalid status line: {status_line[:200]!r}")
+        headers = {}
+        while True:
+            line = (await self._reader.readline()).decode().rstrip("\r\n")
+            if not line:
+                break
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+        if headers.get("transfer-encoding") == "chunked":
+            chunks = []
+            while True:
+                size = int((await self._reader.readline()).split(b";")[0], 16)
+                chunk = await self._reader.readexactly(size + 2)
+                if not size:
+                    break
+                chunks.append(chunk[:-2])
+            content = b"".join(chunks)
+        else:
+            content = await self._reader.readexactly(int(headers.get("content-length", 0)))
+        if headers.get("connection", "").lower() == "close":
+            self._writer.close()
+        return status, content
+
+    async def login(self, username: str, password: str) -> Optional[str]:
+        """Create an auth token, and return the previous one of the client."""
+        status, content = await self.request(
+            "POST", "/api/tokens", {"username": username, "password": password}
+        )
+        if status != 200:
+            raise GuacamoleLoadError(f"login failed: {status} {content[:200]!r}")
+        previous = self.token
+        response = json.loads(content)
+        self.token, self.data_source = response["authToken"], response["dataSource"]
+        return previous
+
+    async def logout(self, token: str):
+        """Delete an auth token."""
+        await self.request("DELETE", f"/api/tokens/{token}")
+
+    async def list_connections(self) -> dict:
+        """Connections of the data source, by identifier."""
+        status, content = await self.request(
+            "GET",
+            f"/api/session/data/{self.data_source}/connections",
+            headers={"Guacamole-Token": self.token},
+        )
+        if status != 200:
+            raise GuacamoleLoadError(f"connection listing failed: {status} {content[:200]!r}")
+        return json.loads(content)
+
+    async def open_tunnel(self, connection_id: str) -> str:
+        """Open an HTTP tunnel to a connection, and return the tunnel UUID."""
+        status, content = await self.request(
+            "POST",
+            "/tunnel?connect",
+            {
+                "token": self.token,
+                "GUAC_DATA_SOURCE": self.data_source,
+                "GUAC_ID": connection_id,
+                "GUAC_TYPE": "c",
+                "GUAC_WIDTH": 1024,
+                "GUAC_HEIGHT": 768,
+                "GUAC_DPI": 96,
+            },
+        )
+        if status != 200:
+            raise GuacamoleLoadError(f"tunnel open failed: {status} {content[:200]!r}")
+        return content.decode().strip()
+
+    async def close_tunnel(self, tunnel: str):
+        """Close an HTTP tunnel, sending a disconnect instruction."""
+        await self.request(
+            "POST",
+            f"/tunnel?write:{tunnel}",
+            b"10.disconnect;",
+            {"Content-Type": "application/octet-stream"},
+        )
+
+    def close(self):
+        """Close the HTTP connection."""
+        if self._writer:
+            self._writer.close()
+
+
+class LoadGenerator:
+    """Runs workers against a Guacamole unit, and collects the stats of their operations."""
+
+    def __init__(
+        self,
+        url: str,
+        username: str,
+        password: str,
+        concurrency: int = 10,
+        requests: int = 1000,
+        duration: Optional[float] = None,
+        mix: Optional[Dict[str, int]] = None,
+        seed: Optional[int] = None,
+    ):
+        self.url = url
+        self.username = username
+        self.password = password
+        self.concurrency = concurrency
+        self.requests = requests
+        self.duration = duration
+        self.mix = mix or DEFAULT_MIX
+        self.stats = {name: OperationStats() for name in OPERATIONS if self.mix.get(name)}
+        # Failures of the login, connection listing and logout of the workers themselves
+        self.worker_errors = 0
+        self._random = random.Random(seed)
+        self._issued = 0
+        self._deadline = None
+
+    async def run(self) -> dict:
+        """Run the load, and return the throughput and latency report."""
+        start = time.monotonic()
+        self._deadline = start + self.duration if self.duration else None
+        await asyncio.gather(*(self._worker() for _ in range(self.concurrency)))
+        elapsed = time.monotonic() - start
+        operations = {name: stats.report(elapsed) for name, stats in self.stats.items()}
+        requests = sum(report["requests"] for report in operations.values())
+        return {
+            "requests": requests,
+            "errors": sum(report["errors"] for report in operations.values()) + self.worker_errors,
+            "worker-errors": self.worker_errors,
+            "concurrency": self.concurrency,
+            "elapsed-seconds": round(elapsed, 3),
+            "requests-per-second": round(requests / elapsed, 1) if elapsed else requests,
+            "operations": operations,
+        }
+
+    def _next_operation(self) -> Optional[str]:
+        if self._issued >= self.requests or (
+            self._deadline and time.monotonic() >= self._deadline
+        ):
+            return None
+        self._issued += 1
+        names = list(self.stats)
+        return self._random.choices(names, [self.mix[name] for name in names])[0]
+
+    async def _worker(self):
+        client = GuacamoleClient(self.url)
+        try:
+            await client.login(self.username, self.password)
+            connections = list(await client.list_connections())
+            while True:
+                operation = self._next_operation()
+                if not operation:
+                    break
+                await self._run_operation(client, operation, connections)
+            await client.logout(client.token)
+        except (GuacamoleLoadError, OSError, asyncio.IncompleteReadError) as e:
+            # The worker cannot run operations without a token, the others go on
+            self.worker_errors += 1
+            logger.warning(f"worker failed: {e}")
+        finally:
+            client.close()
+
+    async def _run_operation(self, client: GuacamoleClient, operation: str, connections: list):
+        stats = self.stats[operation]
+        start = time.monotonic()
+        try:
+            if operation == "tokens":
+                previous = await client.login(self.username, self.password)
+                stats.latencies.append(time.monotonic() - start)
+                await client.logout(previous)
+            elif operation == "connections":
+                await client.list_connections()
+                stats.latencies.append(time.monotonic() - start)
+            elif not connections:
+                raise GuacamoleLoadError("no connections to open tunnels to")
+            else:
+                tunnel = await client.open_tunnel(self._random.choice(connections))
+                stats.latencies.append(time.monotonic() - start)
+                await client.close_tunnel(tunnel)
+        except (GuacamoleLoadError, OSError, asyncio.IncompleteReadError) as e:
+            stats.errors += 1
+            logger.debug(f"{operation} failed: {e}")
+
+
+async def run_load(url: str, username: str, password: str, **kwargs) -> dict:
+    """Run a load against the Guacamole unit at url, and return the report.
+
+    Args:
+        url: base URL of the Guacamole web application, like http://<pod_ip>:8080/guacamole.
+        username: Guacamole user the workers log in as.
+        password: password of the user.
+        kwargs: concurrency, requests, duration, mix and seed of the LoadGenerator.
+
+    Returns:
+        Total and per-operation requests, errors, throughput and p50/p95/p99 latencies.
+    """
+    return await LoadGenerator(url, username, password, **kwargs).run()
+
+
+def main():
+    """Run a load from the command line, against a unit or a local stub server."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--url", help="Guacamole URL; a local stub server is used if not set")
+    parser.add_argument("--username", default="guacadmin")
+    parser.add_argument("--password", default="guacadmin")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--duration", type=float, help="maximum duration, in seconds")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+    options = {
+        "concurrency": args.concurrency,
+        "requests": args.requests,
+        "duration": args.duration,
+        "mix": args.mix,
+        "seed": args.seed,
+    }
+
+    async def _run():
+        if args.url:
+            return await run_load(args.url, args.username, args.password, **options)
+        from tests.load.guacamole_stub import GuacamoleStubServer
+
+        async with GuacamoleStubServer(username=args.username, password=args.password) as stub:
+            return await run_load(stub.url, args.username, args.password, **options)
+
+    print(json.dumps(asyncio.run(_run()), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""In-process stub of the Guacamole REST API and HTTP tunnel endpoints.
+
+The stub answers the requests of the load generator the way a Guacamole unit does: it creates
+auth tokens, lists connections, and opens (and closes) HTTP tunnels without a guacd behind them.
+A fixed latency can be added to every request, to simulate the work of a real unit.
+"""
+
+import asyncio
+import json
+import secrets
+import uuid
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+REASONS = {200: "OK", 204: "No Content", 400: "Bad Request", 403: "Forbidden", 404: "Not Found"}
+
+
+class GuacamoleStubServer:
+    """Guacamole stub server, listening in a random local port.
+
+    Example:
+        async with GuacamoleStubServer(connections=10) as server:
+            report = await run_load(server.url, "guacadmin", "guacadmin")
+    """
+
+    def __init__(
+        self,
+        connections: int = 10,
+        latency: float = 0.0,
+        username: str = "guacadmin",
+        password: str = "guacadmin",
+        data_source: str = "mysql",
+        keep_alive_requests: Optional[int] = None,
+    ):
+        self.latency = latency
+        self.keep_alive_requests = keep_alive_requests
+        self.username = username
+        self.password = password
+        self.data_source = data_source
+        self.connections = {
+            str(i): {
+                "name": f"desktop-{i}",
+                "identifier": str(i),
+                "parentIdentifier": "ROOT",
+                "protocol": "rdp",
+                "attributes": {},
+                "activeConnections": 0,
+            }
+            for i in range(1, connections + 1)
+        }
+        self.tokens = set()
+        self.tunnels = {}
+        self.requests = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    @property
+    def url(self) -> str:
+        """Base URL of the Guacamole web application."""
+        host, port = self._server.sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}/guacamole"
+
+    async def start(self):
+        """Start serving in the running event loop."""
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+
+    async def stop(self):
+        """Stop serving."""
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def __aenter__(self):
+        """Start serving."""
+        await self.start()
+        return self
+
+    async def __aexit__(self, *_):
+        """Stop serving."""
+        await self.stop()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        served = 0
+        try:
+            while self.keep_alive_requests is None or served < self.keep_alive_requests:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode().split(" ", 2)
+                headers = {}
+                while True:
+                    line = (await reader.readline()).decode().rstrip("\r\n")
+                    if not line:
+                        break
+                    name, value = line.split(":", 1)
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                self.requests += 1
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                status, content_type, content = self._route(method, target, headers, body)
+                writer.write(
+                    f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Length: {len(content)}\r\n\r\n".encode() + content
+                )
+                await writer.drain()
+                served += 1
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def _route(self, method: str, target: str, headers: dict, body: bytes) -> Tuple:
+        url = urlsplit(target)
+        path = url.path.replace("/guacamole", "", 1)
+        query = parse_qs(url.query)
+        form = {name: values[0] for name, values in parse_qs(body.decode()).items()}
+        token = headers.get("guacamole-token") or query.get("token", [None])[0]
+        if method == "POST" and path == "/api/tokens":
+            return self._create_token(form)
+        if method == "DELETE" and path.startswith("/api/tokens/"):
+            self.tokens.discard(path.rsplit("/", 1)[1])
+            return 204, "text/plain", b""
+        if path == "/tunnel" and url.query == "connect":
+            return self._open_tunnel(form)
+        if path == "/tunnel" and url.query.startswith("write:"):
+            return self._write_tunnel(url.query.split(":")[1], body)
+        if token not in self.tokens:
+            return _json(403, {"message": "Permission Denied.", "type": "PERMISSION_DENIED"})
+        if method == "GET" and path == f"/api/session/data/{self.data_source}/connections":
+            return _json(200, self.connections)
+        return _json(404, {"message": "Not found.", "type": "NOT_FOUND"})
+
+    def _create_token(self, form: Dict[str, str]) -> Tuple:
+        if (form.get("username"), form.get("password")) != (self.username, self.password):
+            return _json(403, {"message": "Invalid login.", "type": "INVALID_CREDENTIALS"})
+        token = secrets.token_hex(32).upper()
+        self.tokens.add(token)
+        return _json(
+            200,
+            {
+                "authToken": token,
+                "username": self.username,
+                "dataSource": self.data_source,
+                "availableDataSources": [self.data_source],
+            },
+        )
+
+    def _open_tunnel(self, form: Dict[str, str]) -> Tuple:
+        if form.get("token") not in self.tokens:
+            return _json(403, {"message": "Permission Denied.", "type": "PERMISSION_DENIED"})
+        connection = self.connections.get(form.get("GUAC_ID"))
+        if not connection or form.get("GUAC_DATA_SOURCE") != self.data_source:
+            return _json(404, {"message": "No such connection.", "type": "NOT_FOUND"})
+        tunnel = str(uuid.uuid4())
+        self.tunnels[tunnel] = connection
+        connection["activeConnections"] += 1
+        return 200, "text/plain", tunnel.encode()
+
+    def _write_tunnel(self, tunnel: str, body: bytes) -> Tuple:
+        if tunnel not in self.tunnels:
+            return 404, "text/plain", b""
+        if b".disconnect;" in body:
+            self.tunnels.pop(tunnel)["activeConnections"] -= 1
+        return 200, "text/plain", b""
+
+
+def _json(status: int, content) -> Tuple:
+    return status, "application/json", json.dumps(content).encode()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Load tests of the Guacamole REST and tunnel endpoints.
+
+Run them with `tox -e load`. They run against a local stub server, or against the unit in the
+GUACAMOLE_URL environment variable, like http://<pod_ip>:8080/guacamole, when it is set.
+"""
+
+import asyncio
+import json
+import logging
+import os
+
+import pytest
+
+from tests.load.guacamole_load import parse_mix, percentile, run_load
+from tests.load.guacamole_stub import GuacamoleStubServer
+
+logger = logging.getLogger(__name__)
+
+USERNAME = os.environ.get("GUACAMOLE_USERNAME", "guacadmin")
+PASSWORD = os.environ.get("GUACAMOLE_PASSWORD", "guacadmin")
+
+
+async def _run_load(**kwargs) -> dict:
+    url = os.environ.get("GUACAMOLE_URL")
+    if url:
+        return await run_load(url, USERNAME, PASSWORD, **kwargs)
+    async with GuacamoleStubServer(latency=0.001) as stub:
+        report = await run_load(stub.url, USERNAME, PASSWORD, **kwargs)
+        assert not stub.tunnels
+        assert not stub.tokens
+        return report
+
+
+def test_percentile():
+    values = list(range(100, 0, -1))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile(values, 100) == 100
+    assert percentile([3.0], 95) == 3.0
+    assert percentile([], 50) == 0.0
+
+
+def test_parse_mix():
+    assert parse_mix("tokens=1, connections=8,tunnel=0") == {
+        "tokens": 1,
+        "connections": 8,
+        "tunnel": 0,
+    }
+    with pytest.raises(ValueError):
+        parse_mix("tokens=1,history=2")
+    with pytest.raises(ValueError):
+        parse_mix("tokens=0")
+
+
+@pytest.mark.parametrize("concurrency", [1, 10, 50])
+def test_load(concurrency: int):
+    report = asyncio.run(_run_load(concurrency=concurrency, requests=1000, seed=1))
+    logger.info(f"concurrency {concurrency}: {json.dumps(report)}")
+    assert report["requests"] == 1000
+    assert report["errors"] == 0
+    assert set(report["operations"]) == {"tokens", "connections", "tunnel"}
+
+
+def test_load_duration():
+    report = asyncio.run(_run_load(concurrency=5, requests=10**9, duration=1, mix={"tunnel": 1}))
+    assert 0 < report["requests"] < 10**9
+    assert report["elapsed-seconds"] < 2
+    assert set(report["operations"]) == {"tunnel"}
+
+
+def test_load_reconnects_closed_connections():
+    async def _run():
+        # The stub closes every connection after 3 requests, without telling the client
+        async with GuacamoleStubServer(keep_alive_requests=3) as stub:
+            return await run_load(stub.url, "guacadmin", "guacadmin", concurrency=5, requests=100)
+
+    report = asyncio.run(_run())
+    assert report["requests"] == 100
+    assert report["errors"] == 0
+
+
+def test_load_counts_worker_errors():
+    async def _run():
+        async with GuacamoleStubServer() as stub:
+            return await run_load(stub.url, "guacadmin", "wrong", concurrency=5, requests=100)
+
+    report = asyncio.run(_run())
+    assert report["requests"] == 0
+    assert report["worker-errors"] == 5
+    assert report["errors"] == 5
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""In-process server speaking enough of the MySQL protocol to run pymysql against it.
+
+Queries are answered by a handler, which receives the query text (with the parameters already
+interpolated by the client) and returns either None or the number of affected rows (for an OK
+packet), or a ResultSet. Handlers raise MysqlStubError to answer with an ERR packet. A fixed
+latency can be added to every query, to simulate the round trip to a remote database.
+"""
+
+import datetime
+import socket
+import socketserver
+import struct
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional, Union
+
+# Capability flags: LONG_PASSWORD, FOUND_ROWS, LONG_FLAG, CONNECT_WITH_DB, PROTOCOL_41,
+# TRANSACTIONS, SECURE_CONNECTION, MULTI_STATEMENTS, MULTI_RESULTS, PLUGIN_AUTH
+CAPABILITIES = 0x1 | 0x2 | 0x4 | 0x8 | 0x200 | 0x2000 | 0x8000 | 0x10000 | 0x20000 | 0x80000
+SERVER_STATUS_AUTOCOMMIT = 0x2
+COM_QUIT, COM_INIT_DB, COM_QUERY, COM_PING = 0x01, 0x02, 0x03, 0x0E
+UTF8_CHARSET, BINARY_CHARSET = 33, 63
+TYPE_DOUBLE, TYPE_LONGLONG, TYPE_DATETIME, TYPE_BLOB, TYPE_VAR_STRING = 5, 8, 12, 252, 253
+
+
+@dataclass
+class ResultSet:
+    """Rows returned by a query."""
+
+    columns: List[str]
+    rows: List[tuple] = field(default_factory=list)
+
+
+class MysqlStubError(Exception):
+    """Error returned to the client in an ERR packet."""
+
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+Handler = Callable[[str], Union[None, int, ResultSet]]
+
+
+def _lenenc_int(value: int) -> bytes:
+    if value < 251:
+        return struct.pack("<B", value)
+    if value < 2**16:
+        return b"\xfc" + struct.pack("<H", value)
+    if value < 2**24:
+        return b"\xfd" + struct.pack("<I", value)[:3]
+    return b"\xfe" + struct.pack("<Q", value)
+
+
+def _lenenc_str(value: bytes) -> bytes:
+    return _lenenc_int(len(value)) + value
+
+
+def _encode_value(value) -> bytes:
+    if value is None:
+        return b"\xfb"
+    if isinstance(value, bytes):
+        return _lenenc_str(value)
+    if isinstance(value, datetime.datetime):
+        value = value.strftime("%Y-%m-%d %H:%M:%S")
+    return _lenenc_str(str(value).encode())
+
+
+def _column_type(rows: List[tuple], index: int) -> tuple:
+    value = next((row[index] for row in rows if row[index] is not None), "")
+    if isinstance(value, bool) or isinstance(value, int):
+        return TYPE_LONGLONG, BINARY_CHARSET
+    if isinstance(value, float):
+        return TYPE_DOUBLE, BINARY_CHARSET
+    if isinstance(value, datetime.datetime):
+        return TYPE_DATETIME, BINARY_CHARSET
+    if isinstance(value, bytes):
+        return TYPE_BLOB, BINARY_CHARSET
+    return TYPE_VAR_STRING, UTF8_CHARSET
+
+
+class _MysqlStubRequestHandler(socketserver.BaseRequestHandler):
+    server: "_MysqlStubTCPServer"
+
+    def handle(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._rfile = self.request.makefile("rb")
+        self._send(self._handshake(), 0)
+        _, seq = self._read()
+        self._send(self._ok(), seq + 1)
+        while True:
+            try:
+                payload, seq = self._read()
+            except ConnectionError:
+                return
+            command, argument = payload[0], payload[1:]
+            if command == COM_QUIT:
+                return
+            if command == COM_QUERY:
+                self._query(argument.decode(errors="replace"), seq + 1)
+            elif command in (COM_INIT_DB, COM_PING):
+                self._send(self._ok(), seq + 1)
+            else:
+                self._send(self._error(1047, "Unknown command"), seq + 1)
+
+    def _query(self, query: str, seq: int):
+        self.server.queries.append(query)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        try:
+            result = self.server.handler(query)
+        except MysqlStubError as e:
+            self._send(self._error(e.code, e.message), seq)
+            return
+        if isinstance(result, ResultSet):
+            self._send_result_set(result, seq)
+        else:
+            self._send(self._ok(result or 0), seq)
+
+    def _send_result_set(self, result: ResultSet, seq: int):
+        packets = [_lenenc_int(len(result.columns))]
+        for index, column in enumerate(result.columns):
+            column_type, charset = _column_type(result.rows, index)
+            packets.append(
+                b"".join(_lenenc_str(value) for value in [b"def", b"", b"", b"", column.encode()])
+                + _lenenc_str(column.encode())
+                + struct.pack("<BHIBHBxx", 0x0C, charset, 1024, column_type, 0, 0)
+            )
+        packets.append(self._eof())
+        for row in result.rows:
+            packets.append(b"".join(_encode_value(value) for value in row))
+        packets.append(self._eof())
+        self.request.sendall(
+            b"".join(self._packet(packet, seq + offset) for offset, packet in enumerate(packets))
+        )
+
+    def _handshake(self) -> bytes:
+        salt = b"12345678901234567890"
+        return (
+            b"\x0a5.7.99-stub\x00"
+            + struct.pack("<I", threading.get_ident() & 0xFFFFFFFF)
+            + salt[:8]
+            + b"\x00"
+            + struct.pack("<HBHHB", CAPABILITIES & 0xFFFF, UTF8_CHARSET, 2, CAPABILITIES >> 16, 21)
+            + b"\x00" * 10
+            + salt[8:]
+            + b"\x00mysql_native_password\x00"
+        )
+
+    @staticmethod
+    def _ok(affected_rows: int = 0) -> bytes:
+        return (
+            b"\x00"
+            + _lenenc_int(affected_rows)
+            + _lenenc_int(0)
+            + struct.pack("<HH", SERVER_STATUS_AUTOCOMMIT, 0)
+        )
+
+    @staticmethod
+    def _eof() -> bytes:
+        return b"\xfe" + struct.pack("<HH", 0, SERVER_STATUS_AUTOCOMMIT)
+
+    @staticmethod
+    def _error(code: int, message: str) -> bytes:
+        return b"\xff" + struct.pack("<H", code) + b"#HY000" + message.encode()
+
+    def _read(self) -> tuple:
+        header = self._rfile.read(4)
+        if len(header) < 4:
+            raise ConnectionError("connection closed")
+        length = int.from_bytes(header[:3], "little")
+        return self._rfile.read(length), header[3]
+
+    def _send(self, payload: bytes, seq: int):
+        self.request.sendall(self._packet(payload, seq))
+
+    @staticmethod
+    def _packet(payload: bytes, seq: int) -> bytes:
+        return struct.pack("<I", len(payload))[:3] + bytes([seq & 0xFF]) + payload
+
+
+class _MysqlStubTCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, handler: Handler, latency: float):
+        super().__init__(("127.0.0.1", 0), _MysqlStubRequestHandler)
+        self.handler = handler
+        self.latency = latency
+        self.queries = []
+
+
+class MysqlStubServer:
+    """MySQL protocol stub server, listening in a random local port.
+
+    Example:
+        with MysqlStubServer(lambda query: ResultSet(["id"], [(1,)])) as server:
+            Mysql(server.host, server.port, "user", "password", "db").execute(sql)
+    """
+
+    def __init__(self, handler: Optional[Handler] = None, latency: float = 0.0):
+        self._server = _MysqlStubTCPServer(handler or (lambda _: None), latency)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def host(self) -> str:
+        """Host the server listens on."""
+        return self._server.server_address[0]
+
+    @property
+    def port(self) -> int:
+        """Port the server listens on."""
+        return self._server.server_address[1]
+
+    @property
+    def queries(self) -> List[str]:
+        """Queries received by the server."""
+        return self._server.queries
+
+    @property
+    def handler(self) -> Handler:
+        """Handler answering the queries."""
+        return self._server.handler
+
+    @handler.setter
+    def handler(self, handler: Handler):
+        self._server.handler = handler
+
+    def start(self):
+        """Start serving in a background thread."""
+        self._thread.start()
+
+    def stop(self):
+        """Stop serving."""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        """Start serving."""
+        self.start()
+        return self
+
+    def __exit__(self, *_):
+        """Stop serving."""
+        self.stop()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import datetime
+from types import SimpleNamespace
+
+from pytest_mock import MockerFixture
+
+from appcds import AppCDSArchive, archive_to_dump, parse_java_version
+
+JAVA_17_VERSION = """openjdk version "17.0.2" 2022-01-18
+OpenJDK Runtime Environment (build 17.0.2+8-86)
+"""
+
+
+def test_parse_java_version():
+    assert parse_java_version('openjdk version "1.8.0_292"') == 8
+    assert parse_java_version(JAVA_17_VERSION) == 17
+    assert parse_java_version('openjdk version "13" 2019-09-17') == 13
+    assert parse_java_version("java: not found") is None
+
+
+def test_archive_to_dump():
+    assert archive_to_dump("-Xmx512m -XX:ArchiveClassesAtExit=/a/b.jsa") == "/a/b.jsa"
+    assert archive_to_dump("-XX:SharedArchiveFile=/a/b.jsa -Xshare:auto") is None
+
+
+def _file(path: str, size: int = 1) -> SimpleNamespace:
+    return SimpleNamespace(path=path, size=size, last_modified=datetime.datetime(2021, 1, 1))
+
+
+def test_appcds_archive(mocker: MockerFixture):
+    files = {"/appcds": [], "/usr/local/tomcat/lib": [_file("/usr/local/tomcat/lib/a.jar")]}
+    container_mock = mocker.Mock()
+    container_mock.exec.return_value.wait_output.return_value = ("", JAVA_17_VERSION)
+    container_mock.list_files.side_effect = lambda path, **_: files.get(path, [])
+    container_mock.exists.return_value = False
+    appcds = AppCDSArchive(container_mock, "/jdk", "/appcds")
+    options = appcds.java_options()
+    assert options.startswith("-XX:ArchiveClassesAtExit=/appcds/guacamole-")
+    container_mock.exec.assert_called_once_with(["/jdk/bin/java", "-version"])
+    archive = options.split("=")[1]
+    container_mock.exists.return_value = True
+    assert appcds.java_options() == f"-XX:SharedArchiveFile={archive} -Xshare:auto"
+    # A new image has a new archive, and the previous one is removed
+    files["/appcds"] = [_file(archive)]
+    files["/usr/local/tomcat/lib"] = [_file("/usr/local/tomcat/lib/a.jar", 2)]
+    container_mock.exists.return_value = False
+    assert archive not in appcds.java_options()
+    container_mock.remove_path.assert_called_once_with(archive)
+
+
+def test_appcds_archive_unsupported_java(mocker: MockerFixture):
+    container_mock = mocker.Mock()
+    container_mock.exec.return_value.wait_output.return_value = ("", 'version "1.8.0_292"')
+    assert AppCDSArchive(container_mock, "/jdk").java_options() == ""
+    container_mock.list_files.assert_not_called()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import gzip
+
+import pytest
+
+from backup import BackupWriter, iter_backup, iter_statements
+
+SQL = (
+    "SET FOREIGN_KEY_CHECKS=0;\n"
+    "INSERT INTO `t;1` VALUES ('a;b', 'it\\'s', \"x;\\\\\", 'c''d;');\n"
+    ";\n"
+    "INSERT INTO t VALUES (X'00ff');\n"
+)
+STATEMENTS = [
+    "SET FOREIGN_KEY_CHECKS=0;",
+    "INSERT INTO `t;1` VALUES ('a;b', 'it\\'s', \"x;\\\\\", 'c''d;');",
+    "INSERT INTO t VALUES (X'00ff');",
+]
+
+
+@pytest.mark.parametrize("piece_size", [1, 2, 7, 1000])
+def test_iter_statements(piece_size: int):
+    pieces = [SQL[i:][:piece_size] for i in range(0, len(SQL), piece_size)]
+    assert list(iter_statements(pieces)) == STATEMENTS
+
+
+def test_iter_statements_incomplete():
+    with pytest.raises(ValueError):
+        list(iter_statements(["SELECT 1; SELECT 'a;"]))
+
+
+def test_backup_writer(tmp_path):
+    with BackupWriter(str(tmp_path), chunk_size=60) as writer:
+        for statement in STATEMENTS:
+            writer.write(statement)
+    assert [path.rsplit("/", 1)[1] for path in writer.files] == [
+        "guacamole-backup-00000.sql.gz",
+        "guacamole-backup-00001.sql.gz",
+    ]
+    with gzip.open(writer.files[0], "rt") as chunk:
+        assert chunk.read() == f"{STATEMENTS[0]}\n{STATEMENTS[1]}\n"
+    assert writer.compressed_size > 0
+    assert list(iter_statements(iter_backup(str(tmp_path)))) == STATEMENTS
+    with pytest.raises(ValueError, match="already has a backup"):
+        BackupWriter(str(tmp_path), 60)
+    with pytest.raises(ValueError, match="no backup found"):
+        list(iter_backup(str(tmp_path / "empty")))
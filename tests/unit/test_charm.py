@@ -3,15 +3,18 @@
 
 from ipaddress import IPv4Address
 
+import pymysql
 import pytest
-from ops.model import ActiveStatus, BlockedStatus, MaintenanceStatus
+from ops.model import ActiveStatus, BlockedStatus, MaintenanceStatus, WaitingStatus
 from ops.testing import Harness
 from pytest_mock import MockerFixture
 
-from charm import ApacheGuacamoleCharm, pod_ip
+from charm import ApacheGuacamoleCharm, ingress_limits, pod_ip, wait_for_http
+from mysql import RestoreError
 
 pebble_exec_mock = None
 mysql_rel_id = None
+cluster_rel_id = None
 
 
 def test_pod_ip(mocker: MockerFixture):
@@ -26,12 +29,15 @@ def test_pod_ip(mocker: MockerFixture):
 @pytest.fixture
 def harness_no_relations(mocker: MockerFixture):
     mocker.patch("charm.KubernetesServicePatch")
+    mocker.patch("charm.KubernetesResourcesPatch")
+    mocker.patch("charm.TomcatServer")
     process_mock = mocker.Mock()
     process_mock.wait_output.return_value = ("sql", None)
     global pebble_exec_mock
     pebble_exec_mock = mocker.patch("ops.testing._TestingPebbleClient.exec")
     pebble_exec_mock.return_value = process_mock
     mocker.patch("charm.Mysql")
+    mocker.patch("charm.wait_for_http", return_value=1.0)
     guacamole_harness = Harness(ApacheGuacamoleCharm)
     guacamole_harness.begin()
     yield guacamole_harness
@@ -60,6 +66,11 @@ def harness(mocker: MockerFixture, harness_no_relations: Harness):
             "database": "db",
         },
     )
+    global cluster_rel_id
+    cluster_rel_id = harness_no_relations.add_relation("cluster", "apache-guacamole")
+    harness_no_relations.update_relation_data(
+        cluster_rel_id, "apache-guacamole", {"schema-fingerprint": "fingerprint"}
+    )
 
     return harness_no_relations
 
@@ -131,3 +142,354 @@ def test_restart_service_service_not_exists(mocker: MockerFixture, harness: Harn
     )
     harness.charm._restart_service()
     container_mock.restart.assert_not_called()
+
+
+def test_prune_history_action(mocker: MockerFixture, harness: Harness):
+    mysql_mock = mocker.patch("charm.Mysql")
+    mysql_mock.return_value.prune_history.return_value = 10
+    event = mocker.Mock(params={"retention-days": 30, "batch-size": 5})
+    harness.charm._on_prune_history_action(event)
+    mysql_mock.return_value.prune_history.assert_called_once_with(30, 5)
+    results = event.set_results.call_args[0][0]
+    assert results["deleted"] == 10
+    assert "rows-per-second" in results
+
+
+def test_prune_history_action_failures(mocker: MockerFixture, harness_no_relations: Harness):
+    event = mocker.Mock(params={"batch-size": 5})
+    harness_no_relations.charm._on_prune_history_action(event)
+    event.fail.assert_called_once()
+    event = mocker.Mock(params={"retention-days": 30, "batch-size": 5})
+    harness_no_relations.charm._on_prune_history_action(event)
+    event.fail.assert_called_once_with("missing relations: mysql")
+
+
+def test_update_status_prunes_history(mocker: MockerFixture, harness: Harness):
+    mysql_mock = mocker.patch("charm.Mysql")
+    mysql_mock.return_value.prune_history.return_value = 0
+    harness.charm.on.update_status.emit()
+    mysql_mock.return_value.prune_history.assert_not_called()
+    harness.set_leader(True)
+    harness.update_config({"history-retention-days": 90})
+    harness.charm.on.update_status.emit()
+    mysql_mock.return_value.prune_history.assert_called_once_with(90, 1000)
+
+
+def test_import_connections_action(mocker: MockerFixture, harness: Harness):
+    mysql_mock = mocker.patch("charm.Mysql")
+    mysql_mock.return_value.import_connections.return_value = {"created": 2, "updated": 1}
+    event = mocker.Mock(params={"connections": "", "format": "yaml", "batch-size": 500})
+    harness.charm._on_import_connections_action(event)
+    results = event.set_results.call_args[0][0]
+    assert results["created"] == 2
+    assert "rows-per-second" in results
+    mysql_mock.return_value.import_connections.side_effect = ValueError("error")
+    harness.charm._on_import_connections_action(event)
+    event.fail.assert_called_once_with("invalid connections: error")
+
+
+@pytest.mark.parametrize(
+    "handler,method,params",
+    [
+        ("_on_prune_history_action", "prune_history", {"retention-days": 30}),
+        ("_on_import_connections_action", "import_connections", {"batch-size": 500}),
+        ("_on_provision_users_action", "provision_users", {"hash-workers": 0}),
+        ("_on_sync_balancing_groups_action", "sync_balancing_groups", {"groups": ""}),
+        ("_on_session_stats_action", "session_stats", {"window-hours": 24}),
+    ],
+)
+def test_actions_database_error(
+    mocker: MockerFixture, harness: Harness, handler: str, method: str, params: dict
+):
+    mysql_mock = mocker.patch("charm.Mysql")
+    getattr(mysql_mock.return_value, method).side_effect = pymysql.err.OperationalError(
+        2003, "Can't connect to MySQL server"
+    )
+    params = {
+        "connections": "",
+        "users": "",
+        "format": "yaml",
+        "batch-size": 1,
+        "limit": 1,
+        **params,
+    }
+    event = mocker.Mock(params=params)
+    getattr(harness.charm, handler)(event)
+    event.fail.assert_called_once_with('database error: (2003, "Can\'t connect to MySQL server")')
+    event.set_results.assert_not_called()
+
+
+def test_provision_users_action(mocker: MockerFixture, harness: Harness):
+    mysql_mock = mocker.patch("charm.Mysql")
+    mysql_mock.return_value.provision_users.return_value = {"created": 2, "skipped": 1}
+    params = {"users": "", "format": "yaml", "batch-size": 500, "hash-workers": 0}
+    event = mocker.Mock(params=params)
+    harness.charm._on_provision_users_action(event)
+    mysql_mock.return_value.provision_users.assert_called_once_with(mocker.ANY, 500, 0)
+    results = event.set_results.call_args[0][0]
+    assert results["created"] == 2
+    assert "users-per-second" in results
+    mysql_mock.return_value.provision_users.side_effect = ValueError("error")
+    harness.charm._on_provision_users_action(event)
+    event.fail.assert_called_once_with("invalid users: error")
+
+
+def test_sync_balancing_groups_action(mocker: MockerFixture, harness: Harness):
+    mysql_mock = mocker.patch("charm.Mysql")
+    mysql_mock.return_value.sync_balancing_groups.return_value = {"groups-created": 1}
+    event = mocker.Mock(params={"groups": "- name: desktops"})
+    harness.charm._on_sync_balancing_groups_action(event)
+    event.set_results.assert_called_once_with({"groups-created": 1})
+    event = mocker.Mock(params={"groups": "- desktops"})
+    harness.charm._on_sync_balancing_groups_action(event)
+    event.fail.assert_called_once_with("invalid groups: invalid record: desktops")
+
+
+def test_session_stats_action(mocker: MockerFixture, harness: Harness):
+    mysql_mock = mocker.patch("charm.Mysql")
+    mysql_mock.return_value.session_stats.return_value = {"active": 1, "peak": 2}
+    event = mocker.Mock(params={"window-hours": 24, "limit": 20})
+    harness.charm._on_session_stats_action(event)
+    mysql_mock.return_value.session_stats.assert_called_once_with(24, "hostname", 20)
+    results = event.set_results.call_args[0][0]
+    assert results["stats"] == '{"active":1,"peak":2}'
+    assert "elapsed-seconds" in results
+
+
+def test_wait_for_http(mocker: MockerFixture):
+    mocker.patch("charm.time.sleep")
+    urlopen_mock = mocker.patch("charm.urlopen")
+    urlopen_mock.side_effect = [OSError(), None]
+    assert wait_for_http("http://localhost", 10) is not None
+    assert urlopen_mock.call_count == 2
+    urlopen_mock.side_effect = OSError()
+    assert wait_for_http("http://localhost", 0) is None
+
+
+def test_fast_start(mocker: MockerFixture, harness: Harness):
+    render_mock = mocker.patch("charm.GuacamoleHome.render")
+    harness.charm.on.guacamole_pebble_ready.emit("guacamole")
+    render_mock.assert_not_called()
+    service = harness.get_container_pebble_plan("guacamole").services["guacamole"]
+    assert service.command == "/opt/guacamole/bin/start.sh"
+    assert service.environment["GUACD_HOSTNAME"] == "hostname"
+    harness.update_config({"fast-start": True})
+    render_mock.assert_called_once()
+    assert render_mock.call_args[0][0]["mysql-hostname"] == "host"
+    service = harness.get_container_pebble_plan("guacamole").services["guacamole"]
+    assert service.command == "/usr/local/tomcat/bin/catalina.sh run"
+    assert service.environment["GUACAMOLE_HOME"] == "/etc/guacamole"
+    assert "GUACD_HOSTNAME" not in service.environment
+
+
+def test_startup_timeout(mocker: MockerFixture, harness: Harness):
+    wait_mock = mocker.patch("charm.wait_for_http", return_value=None)
+    assert not harness.charm._wait_for_guacamole(0)
+    wait_mock.assert_called_once_with("http://localhost:8080/guacamole/", 300)
+    harness.update_config({"startup-timeout": 0})
+    wait_mock.reset_mock()
+    assert harness.charm._wait_for_guacamole(0)
+    wait_mock.assert_not_called()
+
+
+def test_config_changed_waits_for_rolling_restart(mocker: MockerFixture, harness: Harness):
+    rel_id = cluster_rel_id
+    harness.add_relation_unit(rel_id, "apache-guacamole/1")
+    spy = mocker.spy(harness.charm, "_restart_service")
+    harness.charm.on.config_changed.emit()
+    assert harness.charm.unit.status == MaintenanceStatus("waiting for rolling restart")
+    assert spy.call_count == 0
+    request = harness.get_relation_data(rel_id, "apache-guacamole/0")["restart-request"]
+    harness.update_relation_data(
+        rel_id,
+        "apache-guacamole",
+        {"restart-unit": "apache-guacamole/0", "restart-nonce": request},
+    )
+    assert harness.charm.unit.status == ActiveStatus()
+    assert spy.call_count == 1
+
+
+def test_unhealthy_leader_blocks_rolling_restart(mocker: MockerFixture, harness: Harness):
+    harness.set_leader(True)
+    harness.add_relation_unit(cluster_rel_id, "apache-guacamole/1")
+    mocker.patch("charm.wait_for_http", return_value=None)
+    harness.charm.on.config_changed.emit()
+    # The leader took its turn and failed its health check: the rollout is held, visibly
+    assert harness.charm.unit.status == BlockedStatus("guacamole did not start")
+    app_data = harness.get_relation_data(cluster_rel_id, "apache-guacamole")
+    assert app_data["restart-unit"] == "apache-guacamole/0"
+
+
+def test_database_initialized_by_leader(mocker: MockerFixture, harness: Harness):
+    mysql_mock = mocker.patch("charm.Mysql")
+    harness.update_relation_data(cluster_rel_id, "apache-guacamole", {"schema-fingerprint": ""})
+    harness.charm.on.config_changed.emit()
+    assert harness.charm.unit.status == WaitingStatus(
+        "waiting for leader to initialize the database"
+    )
+    mysql_mock.return_value.execute.assert_not_called()
+    # The leader initializes the database and publishes the schema fingerprint
+    harness.set_leader(True)
+    harness.charm.on.config_changed.emit()
+    mysql_mock.return_value.execute.assert_called_once_with("sql")
+    fingerprint = harness.get_relation_data(cluster_rel_id, "apache-guacamole")
+    assert fingerprint["schema-fingerprint"] == harness.charm._stored.schema_fingerprint
+    # Already initialized schemas are not initialized again
+    harness.charm.on.config_changed.emit()
+    mysql_mock.return_value.execute.assert_called_once()
+
+
+def test_database_initialized_by_other_unit(mocker: MockerFixture, harness: Harness):
+    mysql_mock = mocker.patch("charm.Mysql")
+    harness.update_relation_data(cluster_rel_id, "apache-guacamole", {"schema-fingerprint": ""})
+    harness.charm.on.config_changed.emit()
+    spy = mocker.spy(harness.charm, "_restart")
+    harness.update_relation_data(cluster_rel_id, "apache-guacamole", {"schema-fingerprint": "x"})
+    assert spy.call_count == 1
+    assert harness.charm.unit.status == ActiveStatus()
+    mysql_mock.return_value.execute.assert_not_called()
+    pebble_exec_mock.assert_not_called()
+
+
+def test_resources(harness: Harness):
+    harness.set_leader(True)
+    harness.update_config({"memory-limit": "2Gi", "cpu-limit": "2"})
+    harness.charm.resources_patch.patch.assert_called_with({}, {"cpu": "2", "memory": "2Gi"})
+    service = harness.get_container_pebble_plan("guacamole").services["guacamole"]
+    assert service.environment["JAVA_OPTS"] == "-Xmx1536m"
+    harness.update_config({"memory-request": "4Gi"})
+    assert harness.charm.unit.status == BlockedStatus(
+        "invalid config: memory-request exceeds memory-limit"
+    )
+
+
+def test_logging_config(harness: Harness):
+    harness.update_config({"log-level": "debug", "access-log": "off"})
+    harness.charm.tomcat.configure_access_log.assert_called_with("off")
+    harness.charm.tomcat.configure_log_level.assert_called_with("debug")
+    harness.charm.tomcat.configure_static_assets.assert_called_with(365, True)
+    service = harness.get_container_pebble_plan("guacamole").services["guacamole"]
+    assert service.environment["GUACAMOLE_HOME"] == "/etc/guacamole-template"
+    logback = harness.charm.container.pull("/etc/guacamole-template/logback.xml").read()
+    assert '<root level="debug">' in logback
+    harness.update_config({"log-level": "verbose"})
+    assert harness.charm.unit.status.message.startswith("invalid config: log-level must be")
+
+
+def test_ingress_limits():
+    config = {
+        "ingress-limit-rps": 20,
+        "ingress-limit-whitelist": "10.0.0.0/8, 192.168.1.10",
+        "ingress-max-body-size": 0,
+        "ingress-retry-errors": "error,timeout",
+    }
+    assert ingress_limits(config) == {
+        "limit-rps": 20,
+        "limit-whitelist": "10.0.0.0/8,192.168.1.10",
+        "max-body-size": "",
+        "retry-errors": "error,timeout",
+    }
+    with pytest.raises(ValueError, match="invalid network: 10.0.0.0/33"):
+        ingress_limits({**config, "ingress-limit-whitelist": "10.0.0.0/33"})
+    with pytest.raises(ValueError, match="invalid errors: http_999"):
+        ingress_limits({**config, "ingress-retry-errors": "error,http_999"})
+    with pytest.raises(ValueError, match="ingress-limit-rps must not be negative"):
+        ingress_limits({**config, "ingress-limit-rps": -1})
+
+
+def test_ingress_config(harness: Harness):
+    harness.set_leader(True)
+    rel_id = harness.add_relation("ingress", "ingress")
+    harness.update_config({"ingress-limit-rps": 10, "ingress-limit-whitelist": "10.0.0.0/8"})
+    data = harness.get_relation_data(rel_id, harness.charm.app.name)
+    assert data["service-hostname"] == "apache-guacamole"
+    assert data["limit-rps"] == "10"
+    assert data["limit-whitelist"] == "10.0.0.0/8"
+    assert "retry-errors" not in data
+    harness.update_config({"ingress-limit-rps": 0, "ingress-retry-errors": "sometimes"})
+    assert harness.charm.unit.status.message.startswith("invalid config: ingress-retry-errors")
+    assert harness.get_relation_data(rel_id, harness.charm.app.name)["limit-rps"] == "10"
+
+
+def test_warm_up(mocker: MockerFixture, harness: Harness):
+    warm_up_mock = mocker.patch("charm.warm_up", return_value=10.0)
+    harness.charm.on.guacamole_pebble_ready.emit("guacamole")
+    warm_up_mock.assert_not_called()
+    harness.update_config({"warm-up-paths": "/, /api/languages", "startup-timeout": 0})
+    warm_up_mock.assert_called_once_with(
+        "http://localhost:8080/guacamole", ["/", "/api/languages"], 0.2, 120
+    )
+    assert isinstance(harness.charm.unit.status, ActiveStatus)
+
+
+def test_static_assets_precompressed(harness: Harness):
+    harness.charm.on.guacamole_pebble_ready.emit("guacamole")
+    precompress_mock = harness.charm.tomcat.precompress_webapp
+    precompress_mock.assert_called_with("guacamole")
+    precompress_mock.reset_mock()
+    harness.update_config({"static-assets-precompressed": False, "static-assets-max-age": 0})
+    harness.charm.tomcat.configure_static_assets.assert_called_with(0, False)
+    precompress_mock.assert_not_called()
+
+
+def test_appcds(mocker: MockerFixture, harness: Harness):
+    java_options_mock = mocker.patch("charm.AppCDSArchive.java_options")
+    java_options_mock.side_effect = [
+        "-XX:ArchiveClassesAtExit=/archive.jsa",
+        "-XX:SharedArchiveFile=/archive.jsa -Xshare:auto",
+    ]
+    harness.charm.on.guacamole_pebble_ready.emit("guacamole")
+    stop_mock = mocker.patch("ops.model.Container.stop")
+    stop_mock.side_effect = lambda _: harness.charm.container.push("/archive.jsa", "")
+    harness.update_config({"appcds": True})
+    # The JVM dumps the archive when it is stopped, and is started again to load it
+    stop_mock.assert_called_once_with("guacamole")
+    service = harness.get_container_pebble_plan("guacamole").services["guacamole"]
+    assert service.environment["JAVA_OPTS"] == "-XX:SharedArchiveFile=/archive.jsa -Xshare:auto"
+    assert harness.charm._appcds_mode == "loaded"
+    assert isinstance(harness.charm.unit.status, ActiveStatus)
+    # The JVM has time to write the archive before it is killed
+    layer = harness.charm._get_pebble_layer()
+    assert layer["services"]["guacamole"]["kill-delay"] == "60s"
+
+
+def test_appcds_archive_not_written(mocker: MockerFixture, harness: Harness):
+    mocker.patch(
+        "charm.AppCDSArchive.java_options", return_value="-XX:ArchiveClassesAtExit=/a.jsa"
+    )
+    harness.charm.on.guacamole_pebble_ready.emit("guacamole")
+    mocker.patch("ops.model.Container.stop")
+    harness.update_config({"appcds": True})
+    # Without an archive, guacamole is started without AppCDS
+    assert harness.charm._appcds_mode == "off"
+    assert isinstance(harness.charm.unit.status, ActiveStatus)
+
+
+def test_backup_and_restore_actions(mocker: MockerFixture, harness: Harness, tmp_path):
+    mysql_mock = mocker.patch("charm.Mysql")
+    mysql_mock.return_value.backup.side_effect = lambda writer, _: writer.write("SELECT 1;") or {
+        "tables": 1,
+        "rows": 10,
+    }
+    event = mocker.Mock(params={"path": str(tmp_path), "batch-size": 100, "chunk-size": 1})
+    harness.charm._on_backup_action(event)
+    results = event.set_results.call_args[0][0]
+    assert results["rows"] == 10
+    assert results["chunks"] == 1
+    harness.charm._on_backup_action(event)
+    event.fail.assert_called_once_with(f"backup failed: {tmp_path} already has a backup")
+    mysql_mock.return_value.restore.side_effect = lambda statements: {
+        "statements": len(list(statements)),
+        "rows": 0,
+    }
+    event = mocker.Mock(params={"path": str(tmp_path)})
+    harness.charm._on_restore_action(event)
+    assert event.set_results.call_args[0][0]["statements"] == 1
+    event = mocker.Mock(params={"path": str(tmp_path / "missing")})
+    harness.charm._on_restore_action(event)
+    event.fail.assert_called_once_with(f"restore failed: no backup found in {tmp_path}/missing")
+    error = pymysql.err.OperationalError(2013, "Lost connection")
+    mysql_mock.return_value.restore.side_effect = RestoreError(1, 0, error)
+    event = mocker.Mock(params={"path": str(tmp_path)})
+    harness.charm._on_restore_action(event)
+    assert event.fail.call_args[0][0].startswith("restore failed: statement 1 failed")
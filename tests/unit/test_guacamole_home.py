@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import pytest
+from pytest_mock import MockerFixture
+
+from guacamole_home import GuacamoleHome, render_logback, render_properties
+
+
+def test_render_properties():
+    properties = {"mysql-port": "3306", "guacd-port": "4822"}
+    assert render_properties(properties) == "guacd-port: 4822\nmysql-port: 3306\n"
+
+
+def test_guacamole_home_render(mocker: MockerFixture):
+    files = {}
+    container_mock = mocker.Mock()
+    container_mock.list_files.return_value = [
+        mocker.Mock(path="/opt/guacamole/mysql/guacamole-auth-jdbc-mysql-1.3.0.jar"),
+        mocker.Mock(path="/opt/guacamole/mysql/mysql-connector-java-8.0.21.jar"),
+    ]
+    container_mock.push.side_effect = lambda path, content, **_: files.update({path: content})
+    container_mock.exists.side_effect = lambda path: path in files
+    container_mock.pull.side_effect = lambda path: mocker.Mock(read=lambda: files[path])
+    guacamole_home = GuacamoleHome(container_mock, "/home")
+    assert guacamole_home.render({"guacd-port": "4822"})
+    assert files["/home/guacamole.properties"] == "guacd-port: 4822\n"
+    links = [call[0][0] for call in container_mock.exec.call_args_list]
+    assert links == [
+        [
+            "ln",
+            "-sf",
+            "/opt/guacamole/mysql/guacamole-auth-jdbc-mysql-1.3.0.jar",
+            "/home/extensions/",
+        ],
+        ["ln", "-sf", "/opt/guacamole/mysql/mysql-connector-java-8.0.21.jar", "/home/lib/"],
+        ["ln", "-sf", "/opt/guacamole/guacamole.war", "/usr/local/tomcat/webapps/"],
+    ]
+    # Unchanged inputs
+    assert not guacamole_home.render({"guacd-port": "4822"})
+    assert container_mock.exec.call_count == 3
+    # Changed inputs
+    assert guacamole_home.render({"guacd-port": "4823"})
+    assert files["/home/guacamole.properties"] == "guacd-port: 4823\n"
+
+
+def test_render_logback():
+    assert '<root level="debug">' in render_logback("debug")
+    assert "%d{HH:mm:ss.SSS}" in render_logback("info")
+    with pytest.raises(ValueError):
+        render_logback("verbose")
+
+
+def test_guacamole_home_render_template(mocker: MockerFixture):
+    files = {}
+    container_mock = mocker.Mock()
+    container_mock.push.side_effect = lambda path, content, **_: files.update({path: content})
+    container_mock.exists.side_effect = lambda path: path in files
+    container_mock.pull.side_effect = lambda path: mocker.Mock(read=lambda: files[path])
+    template = GuacamoleHome(container_mock, "/template")
+    assert template.render_template("warn")
+    assert '<root level="warn">' in files["/template/logback.xml"]
+    assert "/template/guacamole.properties" not in files
+    assert not template.render_template("warn")
+    assert template.render_template("error")
+    container_mock.exec.assert_not_called()
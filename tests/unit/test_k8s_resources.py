@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import pytest
+from lightkube import ApiError
+from lightkube.models.apps_v1 import StatefulSetSpec
+from lightkube.models.core_v1 import (
+    Container,
+    PodSpec,
+    PodTemplateSpec,
+    ResourceRequirements,
+)
+from lightkube.models.meta_v1 import Status
+from lightkube.resources.apps_v1 import StatefulSet
+from ops.charm import CharmBase
+from ops.testing import Harness
+from pytest_mock import MockerFixture
+
+from k8s_resources import KubernetesResourcesPatch, max_heap_size, resources_from_config
+
+
+def test_resources_from_config():
+    config = {"cpu-request": "500m", "cpu-limit": "2", "memory-request": "", "memory-limit": "1Gi"}
+    assert resources_from_config(config) == ({"cpu": "500m"}, {"cpu": "2", "memory": "1Gi"})
+    with pytest.raises(ValueError, match="cpu-request must be a positive quantity: lots"):
+        resources_from_config({"cpu-request": "lots"})
+    with pytest.raises(ValueError, match="memory-request exceeds memory-limit"):
+        resources_from_config({"memory-request": "2Gi", "memory-limit": "1024Mi"})
+
+
+def test_max_heap_size():
+    assert max_heap_size(None, 75) is None
+    assert max_heap_size("1Gi", 75) == 768
+    assert max_heap_size("1G", 50) == 476
+    with pytest.raises(ValueError):
+        max_heap_size("1Gi", 0)
+
+
+def _statefulset(resources: ResourceRequirements = None) -> StatefulSet:
+    return StatefulSet(
+        spec=StatefulSetSpec(
+            selector=None,
+            serviceName="app",
+            template=PodTemplateSpec(
+                spec=PodSpec(
+                    containers=[
+                        Container(name="charm"),
+                        Container(name="workload", resources=resources),
+                    ]
+                )
+            ),
+        )
+    )
+
+
+@pytest.fixture
+def harness():
+    harness = Harness(CharmBase, meta="name: app")
+    harness.begin()
+    harness.set_leader(True)
+    yield harness
+    harness.cleanup()
+
+
+def test_patch(mocker: MockerFixture, harness: Harness):
+    client_mock = mocker.patch("k8s_resources.Client").return_value
+    client_mock.get.return_value = _statefulset()
+    patch = KubernetesResourcesPatch(harness.charm, "workload")
+    assert patch.patch({"cpu": "500m"}, {"memory": "1Gi"})
+    resources = client_mock.patch.call_args[0][2]["spec"]["template"]["spec"]["containers"][0]
+    assert resources == {
+        "name": "workload",
+        "resources": {
+            "requests": {"cpu": "500m", "memory": None},
+            "limits": {"cpu": None, "memory": "1Gi"},
+        },
+    }
+    # Equivalent resources are not patched again
+    client_mock.patch.reset_mock()
+    client_mock.get.return_value = _statefulset(
+        ResourceRequirements(requests={"cpu": "0.5"}, limits={"memory": "1024Mi"})
+    )
+    assert not patch.patch({"cpu": "500m"}, {"memory": "1Gi"})
+    client_mock.patch.assert_not_called()
+    # Only the leader patches
+    harness.set_leader(False)
+    assert not patch.patch({}, {})
+    assert client_mock.get.call_count == 2
+
+
+def test_patch_failed(mocker: MockerFixture, harness: Harness):
+    client_mock = mocker.patch("k8s_resources.Client").return_value
+    client_mock.get.side_effect = ApiError(status=Status(code=403, message="forbidden"))
+    assert not KubernetesResourcesPatch(harness.charm, "workload").patch({}, {})
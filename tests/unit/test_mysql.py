@@ -2,9 +2,15 @@
 # Copyright 2021 Canonical Ltd.
 # See LICENSE file for licensing details.
 
+import datetime
+
+import pymysql
+import pytest
 from pytest_mock import MockerFixture
 
-from mysql import Mysql
+from backup import BackupWriter, iter_backup, iter_statements
+from mysql import Mysql, RestoreError, hash_password, salt_and_hash_password
+from tests.mysql_stub import MysqlStubError, MysqlStubServer, ResultSet
 
 SQL_SCRIPT = """
 something;
@@ -15,6 +21,17 @@ something else; -- comment
 """
 
 
+@pytest.fixture
+def mysql_connection(mocker: MockerFixture):
+    """Mysql object with a mocked connection, returned with the connection and cursor mocks."""
+    cursor_mock = mocker.MagicMock()
+    connection_mock = mocker.MagicMock()
+    connection_mock.cursor.return_value.__enter__.return_value = cursor_mock
+    pymysql_mock = mocker.patch("mysql.pymysql")
+    pymysql_mock.connect.return_value = connection_mock
+    return Mysql("host", "3306", "user", "password", "db"), connection_mock, cursor_mock
+
+
 def test_mysql(mocker: MockerFixture):
     # Mocks and creation of mysql object
     cursor_mock = mocker.Mock()
@@ -45,3 +62,274 @@ def test_mysql(mocker: MockerFixture):
         assert False
     except Exception as e:
         assert str(e) == "Unknown"
+
+
+def test_mysql_prune_history(mocker: MockerFixture, mysql_connection):
+    mysql, connection_mock, cursor_mock = mysql_connection
+    cursor_mock.fetchone.return_value = {"cutoff": "2021-01-01 00:00:00"}
+    rowcounts = iter([1, 2, 2, 1])
+    cursor_mock.execute.side_effect = lambda *_: setattr(
+        cursor_mock, "rowcount", next(rowcounts, 0)
+    )
+    assert mysql.prune_history(30, 2) == 5
+    assert connection_mock.commit.call_count == 3
+    cursor_mock.execute.assert_any_call(mocker.ANY, ("2021-01-01 00:00:00", 2))
+
+
+def test_mysql_session_stats(mocker: MockerFixture, mysql_connection):
+    mysql, connection_mock, cursor_mock = mysql_connection
+    cursor_mock.fetchone.side_effect = [
+        {"sessions": 3},
+        {"since": "2021-01-01 00:00:00"},
+        {"peak": 5},
+    ]
+    cursor_mock.fetchall.side_effect = [
+        [{"name": "desktop-1", "sessions": 2}, {"name": "desktop-2", "sessions": 1}],
+        [{"name": "alice", "sessions": 3}],
+        [{"name": "guacd", "sessions": 3}],
+    ]
+    assert mysql.session_stats(24, "guacd", 10) == {
+        "active": 3,
+        "connections": {"desktop-1": 2, "desktop-2": 1},
+        "users": {"alice": 3},
+        "guacd": {"guacd": 3},
+        "peak": 5,
+        "window-hours": 24,
+    }
+    cursor_mock.execute.assert_any_call(mocker.ANY, ("guacd", 10))
+    cursor_mock.execute.assert_any_call(mocker.ANY, {"since": "2021-01-01 00:00:00"})
+
+
+def test_mysql_import_connections(mysql_connection):
+    mysql, connection_mock, cursor_mock = mysql_connection
+    cursor_mock.fetchall.side_effect = [
+        [{"connection_name": "existing", "connection_id": 1}],
+        [
+            {"connection_name": "existing", "connection_id": 1},
+            {"connection_name": "new", "connection_id": 2},
+        ],
+    ]
+    connections = [
+        {
+            "name": name,
+            "protocol": "ssh",
+            "parameters": {"hostname": name},
+            "users": ["alice"],
+            "groups": [],
+            "max-connections": None,
+        }
+        for name in ["existing", "new"]
+    ]
+    assert mysql.import_connections(iter(connections), 10) == {"created": 1, "updated": 1}
+    assert connection_mock.commit.call_count == 1
+    update, insert, parameters, permissions = [
+        call[0][1] for call in cursor_mock.executemany.call_args_list
+    ]
+    assert update == [("ssh", None, 1)]
+    # An unset limit keeps the one of the existing connection
+    assert "COALESCE(%s, max_connections)" in cursor_mock.executemany.call_args_list[0][0][0]
+    assert insert == [("new", "ssh", None)]
+    assert parameters == [(1, "hostname", "existing"), (2, "hostname", "new")]
+    assert permissions == [(1, "USER", "alice"), (2, "USER", "alice")]
+
+
+def test_mysql_import_connections_after_sync(mysql_connection):
+    mysql, _, cursor_mock = mysql_connection
+    # desktop-1 was moved into a balancing group by sync-balancing-groups
+    synced = [{"connection_name": "desktop-1", "connection_id": 7}]
+    cursor_mock.fetchall.side_effect = [synced, synced]
+    connection = {
+        "name": "desktop-1",
+        "protocol": "rdp",
+        "parameters": {},
+        "users": [],
+        "groups": [],
+        "max-connections": None,
+    }
+    assert mysql.import_connections(iter([connection]), 10) == {"created": 0, "updated": 1}
+    lookup = cursor_mock.execute.call_args_list[0][0][0]
+    assert "g.type = 'BALANCING' AND g.parent_id IS NULL" in lookup
+    update, insert = [call[0][1] for call in cursor_mock.executemany.call_args_list[:2]]
+    assert update == [("rdp", None, 7)]
+    assert insert == []
+
+
+def test_hash_password():
+    salt = bytes.fromhex("FE24ADC5E11E2B25288D1704ABE67A79E342ECC26064CE69C5B3177795A82264")
+    assert (
+        hash_password("guacadmin", salt).hex().upper()
+        == "CA458A7D494E3BE824F5E1E175A1556C0F8EEF2C2D7DF3633BEC4A29C4411960"
+    )
+    password_hash, salt = salt_and_hash_password("guacadmin")
+    assert len(salt) == 32
+    assert password_hash == hash_password("guacadmin", salt)
+
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_mysql_provision_users(mysql_connection, workers: int):
+    mysql, connection_mock, cursor_mock = mysql_connection
+    cursor_mock.fetchall.return_value = [{"name": "alice"}]
+    users = [
+        {"username": "alice", "password": "secret", "groups": ["developers"]},
+        {"username": "bob", "password": "secret", "groups": ["developers"]},
+    ]
+    assert mysql.provision_users(iter(users), 10, workers) == {"created": 1, "skipped": 1}
+    assert connection_mock.commit.call_count == 1
+    entities, new_users, groups, user_groups, members = [
+        call[0][1] for call in cursor_mock.executemany.call_args_list
+    ]
+    assert entities == [("bob", "USER")]
+    ((password_hash, salt, username),) = new_users
+    assert username == "bob" and password_hash == hash_password("secret", salt)
+    assert groups == [("developers", "USER_GROUP")]
+    assert user_groups == [("developers",)]
+    assert members == [("developers", "alice"), ("developers", "bob")]
+
+
+def test_mysql_sync_balancing_groups(mysql_connection):
+    mysql, connection_mock, cursor_mock = mysql_connection
+    group = {
+        "type": "BALANCING",
+        "max_connections": 10,
+        "max_connections_per_user": None,
+        "enable_session_affinity": 0,
+    }
+    member = {
+        "parent_id": 1,
+        "max_connections": 2,
+        "max_connections_per_user": None,
+        "connection_weight": None,
+        "failover_only": 0,
+    }
+    cursor_mock.fetchall.side_effect = [
+        # Existing groups
+        [{**group, "connection_group_name": "unchanged", "connection_group_id": 1}],
+        # Groups after the inserts
+        [
+            {**group, "connection_group_name": "unchanged", "connection_group_id": 1},
+            {**group, "connection_group_name": "new", "connection_group_id": 2},
+        ],
+        # Connections
+        [
+            {**member, "connection_name": "in-group", "connection_id": 1},
+            {**member, "connection_name": "in-root", "connection_id": 2, "parent_id": None},
+        ],
+    ]
+    connection = {"max-connections": 2, "max-connections-per-user": None, "weight": None}
+    groups = [
+        {
+            "name": name,
+            "max-connections": 10,
+            "max-connections-per-user": None,
+            "enable-session-affinity": False,
+            "connections": [
+                {**connection, "name": connection_name, "failover-only": False}
+                for connection_name in connection_names
+            ],
+        }
+        for name, connection_names in [("unchanged", ["in-group"]), ("new", ["in-root", "x"])]
+    ]
+    assert mysql.sync_balancing_groups(groups) == {
+        "groups-created": 1,
+        "groups-updated": 0,
+        "connections-updated": 1,
+        "connections-unchanged": 1,
+        "connections-missing": "x",
+    }
+    assert connection_mock.commit.call_count == 1
+    inserted_groups, updated_groups, updated_connections = [
+        call[0][1] for call in cursor_mock.executemany.call_args_list
+    ]
+    assert inserted_groups == [("new", "BALANCING", 10, None, 0)]
+    assert updated_groups == []
+    assert updated_connections == [(2, 2, None, None, 0, 2)]
+
+
+def test_mysql_execute_against_server(mysql_stub: MysqlStubServer):
+    created_tables = []
+
+    def handler(query: str):
+        if not query.strip(" \n;"):
+            raise MysqlStubError(1065, "Query was empty")
+        if query.startswith("CREATE TABLE"):
+            if query in created_tables:
+                raise MysqlStubError(1050, "Table 'guacamole_user' already exists")
+            created_tables.append(query)
+
+    mysql_stub.handler = handler
+    sql = "CREATE TABLE guacamole_user (user_id int); -- comment\nINSERT INTO guacamole_user;"
+    Mysql(mysql_stub.host, mysql_stub.port, "user", "password", "db").execute(sql)
+    Mysql(mysql_stub.host, mysql_stub.port, "user", "password", "db").execute(sql)
+    assert mysql_stub.queries.count("CREATE TABLE guacamole_user (user_id int);") == 2
+    assert mysql_stub.queries.count("COMMIT") == 2
+
+    def syntax_error(_):
+        raise MysqlStubError(1064, "syntax error")
+
+    mysql_stub.handler = syntax_error
+    with pytest.raises(pymysql.err.ProgrammingError):
+        Mysql(mysql_stub.host, mysql_stub.port, "user", "password", "db").execute(sql)
+
+
+def test_mysql_backup_and_restore(mysql_stub: MysqlStubServer, tmp_path):
+    users = [
+        (1, "guacadmin", b"\xca\x45;'", datetime.datetime(2021, 1, 1)),
+        (2, "o'brien; x", None, None),
+        (3, "user-3", b"", None),
+    ]
+
+    def database(query: str):
+        if query.startswith("SHOW FULL TABLES"):
+            return ResultSet(["Tables_in_db", "Table_type"], [("guacamole_user", "BASE TABLE")])
+        if query.startswith("SHOW CREATE TABLE"):
+            return ResultSet(
+                ["Table", "Create Table"], [("guacamole_user", "CREATE TABLE `guacamole_user` ()")]
+            )
+        if query.startswith("SELECT * FROM"):
+            return ResultSet(["user_id", "name", "password_hash", "date"], users)
+        if query.startswith("INSERT"):
+            return query.count("), (") + 1
+
+    mysql_stub.handler = database
+    with BackupWriter(str(tmp_path), 1024) as writer:
+        mysql = Mysql(mysql_stub.host, mysql_stub.port, "user", "password", "db")
+        assert mysql.backup(writer, batch_size=2) == {"tables": 1, "rows": 3}
+    assert "START TRANSACTION WITH CONSISTENT SNAPSHOT" in mysql_stub.queries
+    statements = list(iter_statements(iter_backup(str(tmp_path))))
+    assert statements[:3] == [
+        "SET FOREIGN_KEY_CHECKS=0;",
+        "DROP TABLE IF EXISTS `guacamole_user`;",
+        "CREATE TABLE `guacamole_user` ();",
+    ]
+    assert statements[3] == (
+        "INSERT INTO `guacamole_user` (`user_id`, `name`, `password_hash`, `date`) VALUES"
+        " (1, 'guacadmin', X'ca453b27', '2021-01-01 00:00:00'),"
+        " (2, 'o\\'brien; x', NULL, NULL);"
+    )
+    assert statements[-1] == "SET FOREIGN_KEY_CHECKS=1;"
+    mysql_stub.queries.clear()
+    mysql = Mysql(mysql_stub.host, mysql_stub.port, "user", "password", "db")
+    assert mysql.restore(iter(statements)) == {"statements": 6, "rows": 3}
+    executed = [query for query in mysql_stub.queries if query != "COMMIT"]
+    assert executed[-6:] == statements
+
+
+def test_mysql_restore_failure(mysql_stub: MysqlStubServer):
+    def database(query: str):
+        if query.startswith("INSERT INTO `b`"):
+            raise MysqlStubError(1146, "Table 'db.b' doesn't exist")
+        return 1
+
+    mysql_stub.handler = database
+    statements = [
+        "DROP TABLE IF EXISTS `a`;",
+        "INSERT INTO `a` VALUES (1);",
+        "INSERT INTO `b` VALUES (1);",
+    ]
+    mysql = Mysql(mysql_stub.host, mysql_stub.port, "user", "password", "db")
+    with pytest.raises(RestoreError) as e:
+        mysql.restore(iter(statements))
+    assert e.value.statement == 3
+    assert str(e.value).startswith(
+        "statement 3 failed, after 2 statements and 1 rows were restored"
+    )
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import pytest
+import yaml
+
+from payload import iter_balancing_groups, iter_connections, iter_records, iter_users
+
+CSV_CONNECTIONS = """
+name,protocol,users,groups,max-connections,hostname,port
+desktop-1,rdp,alice;bob,,5,10.0.0.1,3389
+desktop-2,ssh,,developers,,10.0.0.2,
+"""
+
+YAML_CONNECTIONS = """
+- name: desktop-1
+  protocol: rdp
+  parameters: {hostname: 10.0.0.1, port: 3389}
+  users: [alice, bob]
+  max-connections: 5
+---
+name: desktop-2
+protocol: ssh
+parameters: {hostname: 10.0.0.2}
+groups: developers
+"""
+
+
+def test_iter_connections():
+    expected = [
+        {
+            "name": "desktop-1",
+            "protocol": "rdp",
+            "parameters": {"hostname": "10.0.0.1", "port": "3389"},
+            "users": ["alice", "bob"],
+            "groups": [],
+            "max-connections": 5,
+        },
+        {
+            "name": "desktop-2",
+            "protocol": "ssh",
+            "parameters": {"hostname": "10.0.0.2"},
+            "users": [],
+            "groups": ["developers"],
+            "max-connections": None,
+        },
+    ]
+    assert list(iter_connections(CSV_CONNECTIONS, "csv")) == expected
+    assert list(iter_connections(YAML_CONNECTIONS, "yaml")) == expected
+
+
+def test_iter_records_yaml_lazily():
+    records = iter_records("- name: desktop-1\n- {name: [", "yaml")
+    # The first item is parsed before the invalid one is read
+    assert next(records) == {"name": "desktop-1"}
+    with pytest.raises(yaml.YAMLError):
+        next(records)
+    documents = "name: desktop-1\n---\n- name: desktop-2\n- name: desktop-3\n"
+    assert [r["name"] for r in iter_records(documents, "yaml")] == [
+        "desktop-1",
+        "desktop-2",
+        "desktop-3",
+    ]
+    assert list(iter_records("", "yaml")) == []
+
+
+def test_iter_connections_invalid():
+    with pytest.raises(ValueError):
+        list(iter_connections("- name: desktop-1", "yaml"))
+    with pytest.raises(ValueError):
+        list(iter_records("- desktop-1", "yaml"))
+    with pytest.raises(ValueError):
+        list(iter_records("", "json"))
+
+
+def test_iter_users():
+    expected = [
+        {"username": "alice", "password": "secret", "groups": ["developers", "operators"]},
+        {"username": "bob", "password": "secret", "groups": []},
+    ]
+    csv_users = "username,password,groups\nalice,secret,developers;operators\nbob,secret,\n"
+    yaml_users = (
+        "- {username: alice, password: secret, groups: [developers, operators]}\n"
+        "- {username: bob, password: secret}\n"
+    )
+    assert list(iter_users(csv_users, "csv")) == expected
+    assert list(iter_users(yaml_users, "yaml")) == expected
+    with pytest.raises(ValueError):
+        list(iter_users("- username: alice", "yaml"))
+
+
+def test_iter_balancing_groups():
+    groups = """
+- name: desktops
+  max-connections: 20
+  enable-session-affinity: true
+  connections:
+    - {name: desktop-1, max-connections: 2, weight: 1}
+"""
+    assert list(iter_balancing_groups(groups)) == [
+        {
+            "name": "desktops",
+            "max-connections": 20,
+            "max-connections-per-user": None,
+            "enable-session-affinity": True,
+            "connections": [
+                {
+                    "name": "desktop-1",
+                    "max-connections": 2,
+                    "max-connections-per-user": None,
+                    "weight": 1,
+                    "failover-only": False,
+                }
+            ],
+        }
+    ]
+    with pytest.raises(ValueError):
+        list(iter_balancing_groups("- name: desktops\n  connections: [{weight: 1}]"))
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import pytest
+from ops.charm import CharmBase
+from ops.testing import Harness
+from pytest_mock import MockerFixture
+
+from rolling_restart import RollingRestart
+
+METADATA = """
+name: test
+peers:
+  cluster:
+    interface: test-cluster
+"""
+
+
+class RollingRestartCharm(CharmBase):
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.healthy = True
+        self.restarts = 0
+        self.rolling_restart = RollingRestart(self, self._restart)
+
+    def _restart(self):
+        self.restarts += 1
+        return self.healthy
+
+
+@pytest.fixture
+def harness():
+    harness = Harness(RollingRestartCharm, meta=METADATA)
+    harness.begin()
+    yield harness
+    harness.cleanup()
+
+
+def test_restart_without_peers(harness: Harness):
+    assert harness.charm.rolling_restart.request()
+    assert harness.charm.restarts == 1
+
+
+def test_leader_restarts_itself_first(harness: Harness):
+    harness.set_leader(True)
+    rel_id = harness.add_relation("cluster", "test")
+    harness.add_relation_unit(rel_id, "test/1")
+    harness.update_relation_data(rel_id, "test/1", {"restart-request": "nonce-1"})
+    assert harness.get_relation_data(rel_id, "test")["restart-unit"] == "test/1"
+    # The leader waits until test/1 finishes its restart
+    assert not harness.charm.rolling_restart.request()
+    assert harness.charm.restarts == 0
+    harness.update_relation_data(rel_id, "test/1", {"restart-done": "nonce-1"})
+    assert harness.charm.restarts == 1
+    # Once every unit has restarted, the turn is released
+    assert "restart-unit" not in harness.get_relation_data(rel_id, "test")
+    harness.update_relation_data(rel_id, "test/1", {"restart-request": "nonce-2"})
+    assert harness.get_relation_data(rel_id, "test")["restart-unit"] == "test/1"
+
+
+def test_unhealthy_leader_holds_turn(harness: Harness):
+    harness.set_leader(True)
+    harness.charm.healthy = False
+    rel_id = harness.add_relation("cluster", "test")
+    harness.add_relation_unit(rel_id, "test/1")
+    # The leader took its turn: it is not waiting, even if it is unhealthy
+    assert harness.charm.rolling_restart.request()
+    assert harness.charm.restarts == 1
+    harness.update_relation_data(rel_id, "test/1", {"restart-request": "nonce-1"})
+    assert harness.get_relation_data(rel_id, "test")["restart-unit"] == "test/0"
+    # A unit that departs while holding the turn releases it
+    harness.remove_relation_unit(rel_id, "test/1")
+    assert harness.get_relation_data(rel_id, "test")["restart-unit"] == "test/0"
+
+
+def test_non_leader_waits_for_turn(mocker: MockerFixture, harness: Harness):
+    mocker.patch("rolling_restart.uuid.uuid4", return_value=mocker.Mock(hex="nonce"))
+    rel_id = harness.add_relation("cluster", "test")
+    harness.add_relation_unit(rel_id, "test/1")
+    assert not harness.charm.rolling_restart.request()
+    assert harness.charm.restarts == 0
+    unit_data = harness.get_relation_data(rel_id, "test/0")
+    assert unit_data["restart-request"] == "nonce"
+    harness.update_relation_data(rel_id, "test", {"restart-unit": "test/1", "restart-nonce": "x"})
+    assert harness.charm.restarts == 0
+    harness.update_relation_data(
+        rel_id, "test", {"restart-unit": "test/0", "restart-nonce": "nonce"}
+    )
+    assert harness.charm.restarts == 1
+    assert unit_data["restart-done"] == "nonce"
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+from pathlib import Path
+
+import ops.storage
+import yaml
+from ops.framework import (
+    EventBase,
+    EventSource,
+    Framework,
+    Object,
+    ObjectEvents,
+    StoredState,
+)
+from pytest_mock import MockerFixture
+
+from state import BatchedJujuStorage, main
+
+
+def test_batched_juju_storage(mocker: MockerFixture):
+    juju_state = {"charm/StoredStateData[_stored]": "{guacd_port: '4822'}\n"}
+
+    def run(args, **kwargs):
+        if args[0].endswith("state-get"):
+            return mocker.Mock(stdout=juju_state.get(args[1], ""))
+        if args[0].endswith("state-set"):
+            juju_state.update(yaml.safe_load(kwargs["input"]))
+        if args[0].endswith("state-delete"):
+            juju_state.pop(args[1], None)
+
+    mocker.patch("state.shutil.which", side_effect=lambda cmd: cmd)
+    run_mock = mocker.patch("ops.storage._run", side_effect=run)
+    subprocess_mock = mocker.patch("state.subprocess.run", side_effect=run)
+    storage = BatchedJujuStorage()
+    # A hook loading the stored state, and emitting a custom event
+    stored = storage.load_snapshot("charm/StoredStateData[_stored]")
+    assert stored == {"guacd_port": "4822"}
+    storage.save_snapshot("charm/on/guacd_changed[1]", {})
+    storage.save_notice("charm/on/guacd_changed[1]", "charm", "_on_config_changed")
+    storage.drop_notice("charm/on/guacd_changed[1]", "charm", "_on_config_changed")
+    storage.drop_snapshot("charm/on/guacd_changed[1]")
+    storage.save_snapshot("charm/StoredStateData[_stored]", {"guacd_port": "4822"})
+    storage.save_snapshot("framework/StoredStateData[_stored]", {"event_count": 1})
+    assert list(storage.notices()) == []
+    storage.commit()
+    # Two state-get calls (stored state and notices) and one state-set call
+    assert run_mock.call_count == 2
+    assert subprocess_mock.call_count == 1
+    assert yaml.safe_load(juju_state["framework/StoredStateData[_stored]"]) == {"event_count": 1}
+    assert "charm/on/guacd_changed[1]" not in juju_state
+    # Nothing changed
+    storage.save_snapshot("framework/StoredStateData[_stored]", {"event_count": 1})
+    storage.commit()
+    assert subprocess_mock.call_count == 1
+    # Deleting keys that were not loaded
+    storage.drop_snapshot("charm/StoredStateData[_stored]")
+    storage.commit()
+    assert "charm/StoredStateData[_stored]" not in juju_state
+
+
+class _Hook(EventBase):
+    pass
+
+
+class _Events(ObjectEvents):
+    hook = EventSource(_Hook)
+
+
+class _Charm(Object):
+    on = _Events()
+    _stored = StoredState()
+
+    def __init__(self, framework: Framework, defer: bool):
+        super().__init__(framework, "charm")
+        self._stored.set_default(value="old")
+        self.defer = defer
+        self.handled = 0
+        framework.observe(self.on.hook, self._on_hook)
+
+    def _on_hook(self, event: _Hook):
+        if self.defer:
+            event.defer()
+        else:
+            self.handled += 1
+
+
+def test_batched_juju_storage_with_framework(mocker: MockerFixture, tmp_path: Path):
+    juju_state = {}
+
+    def run(args, **kwargs):
+        if args[0].endswith("state-get"):
+            return mocker.Mock(stdout=juju_state.get(args[1], ""))
+        if args[0].endswith("state-set"):
+            juju_state.update(yaml.safe_load(kwargs["input"]))
+        if args[0].endswith("state-delete"):
+            juju_state.pop(args[1], None)
+
+    mocker.patch("state.shutil.which", side_effect=lambda cmd: cmd)
+    mocker.patch("ops.storage._run", side_effect=run)
+    mocker.patch("state.subprocess.run", side_effect=run)
+
+    def hook(defer: bool = False, emit: bool = False, value: str = None) -> _Charm:
+        # Every hook runs a new framework, with the state in Juju, like ops.main does
+        framework = Framework(BatchedJujuStorage(), tmp_path, None, None)
+        charm = _Charm(framework, defer)
+        framework.reemit()
+        if emit:
+            charm.on.hook.emit()
+        if value:
+            charm._stored.value = value
+        framework.commit()
+        framework.close()
+        return charm
+
+    assert hook()._stored.value == "old"
+    hook(value="new")
+    assert hook()._stored.value == "new"
+    hook(value="newer")
+    assert hook()._stored.value == "newer"
+    # An event deferred in a hook is handled in the next one, and then forgotten
+    assert hook(defer=True, emit=True).handled == 0
+    assert hook().handled == 1
+    assert hook().handled == 0
+    assert yaml.safe_load(juju_state["#notices#"]) == []
+
+
+def test_main(mocker: MockerFixture):
+    juju_storage = ops.storage.JujuStorage
+
+    def ops_main(charm_class, use_juju_for_storage):
+        assert ops.storage.JujuStorage is BatchedJujuStorage
+
+    ops_main_mock = mocker.patch("state.ops.main.main", side_effect=ops_main)
+    main(_Charm, use_juju_for_storage=False)
+    ops_main_mock.assert_called_once_with(_Charm, use_juju_for_storage=False)
+    assert ops.storage.JujuStorage is juju_storage
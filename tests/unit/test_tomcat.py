@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+from xml.etree import ElementTree
+
+import pytest
+from ops.pebble import ExecError
+from pytest_mock import MockerFixture
+
+from tomcat import (
+    TomcatServer,
+    render_access_log,
+    render_logging_properties,
+    render_static_assets,
+)
+
+SERVER_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<!-- License -->
+<Server port="8005" shutdown="SHUTDOWN">
+  <Service name="Catalina">
+    <Engine name="Catalina" defaultHost="localhost">
+      <Host name="localhost" appBase="webapps">
+        <Valve className="org.apache.catalina.valves.ErrorReportValve" />
+        <Valve className="org.apache.catalina.valves.AccessLogValve" directory="logs" />
+      </Host>
+    </Engine>
+  </Service>
+</Server>
+"""
+
+LOGGING_PROPERTIES = """handlers = java.util.logging.ConsoleHandler
+.handlers = java.util.logging.ConsoleHandler
+
+java.util.logging.ConsoleHandler.level = FINE
+java.util.logging.ConsoleHandler.formatter = org.apache.juli.OneLineFormatter
+"""
+
+WEB_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<web-app xmlns="http://xmlns.jcp.org/xml/ns/javaee" version="4.0">
+    <servlet>
+        <servlet-name>default</servlet-name>
+        <servlet-class>org.apache.catalina.servlets.DefaultServlet</servlet-class>
+        <load-on-startup>1</load-on-startup>
+    </servlet>
+</web-app>
+"""
+
+
+def test_render_access_log():
+    content = render_access_log(SERVER_XML, "off")
+    assert "AccessLogValve" not in content
+    assert "ErrorReportValve" in content
+    assert "<!-- License -->" in content
+    content = render_access_log(SERVER_XML, "unbuffered")
+    assert 'directory="logs" buffered="false"' in content
+    with pytest.raises(ValueError):
+        render_access_log(SERVER_XML, "sampled")
+
+
+def test_tomcat_server_configure_access_log(mocker: MockerFixture):
+    files = {"/conf/server.xml": SERVER_XML}
+    container_mock = mocker.Mock()
+    container_mock.push.side_effect = lambda path, content, **_: files.update({path: content})
+    container_mock.exists.side_effect = lambda path: path in files
+    container_mock.pull.side_effect = lambda path: mocker.Mock(read=lambda: files[path])
+    tomcat = TomcatServer(container_mock, "")
+    assert tomcat.configure_access_log("off")
+    assert "AccessLogValve" not in files["/conf/server.xml"]
+    assert files["/conf/server.xml.charm-original"] == SERVER_XML
+    assert not tomcat.configure_access_log("off")
+    # The valve removed from server.xml is restored from the original
+    assert tomcat.configure_access_log("buffered")
+    assert 'buffered="true"' in files["/conf/server.xml"]
+
+
+def test_render_logging_properties():
+    content = render_logging_properties(LOGGING_PROPERTIES, "warn")
+    assert "java.util.logging.ConsoleHandler.level = WARNING\n" in content
+    assert "java.util.logging.ConsoleHandler.formatter = " in content
+    assert content.endswith("\n.level = WARNING\n")
+    assert render_logging_properties(content, "trace").count("= FINEST") == 2
+    with pytest.raises(ValueError):
+        render_logging_properties(LOGGING_PROPERTIES, "verbose")
+
+
+def test_render_static_assets():
+    content = render_static_assets(WEB_XML, 365, True)
+    assert (
+        "DefaultServlet</servlet-class>\n        <init-param>\n"
+        "            <param-name>precompressed</param-name>\n"
+        "            <param-value>br=.br,gzip=.gz</param-value>"
+    ) in content
+    assert "<param-name>ExpiresByType text/css</param-name>" in content
+    assert "<param-value>access plus 365 days</param-value>" in content
+    assert content.index("</filter-mapping>") < content.index("</web-app>")
+    ElementTree.fromstring(content)
+    content = render_static_assets(WEB_XML, 0, False)
+    assert content == WEB_XML
+    with pytest.raises(ValueError):
+        render_static_assets(WEB_XML, -1, True)
+
+
+def test_tomcat_server_precompress_webapp(mocker: MockerFixture):
+    container_mock = mocker.Mock()
+    container_mock.exists.return_value = False
+    tomcat = TomcatServer(container_mock)
+    assert not tomcat.precompress_webapp("guacamole")
+    container_mock.exists.return_value = True
+    assert tomcat.precompress_webapp("guacamole")
+    command = container_mock.exec.call_args[0][0]
+    assert command[-1] == "/usr/local/tomcat/webapps/guacamole"
+    assert "-name '*.js' -o -name '*.css'" in command[2]
+    container_mock.exec.return_value.wait_output.side_effect = ExecError(
+        command, 1, "", "gzip: No space left on device"
+    )
+    assert not tomcat.precompress_webapp("guacamole")
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+from urllib.error import HTTPError, URLError
+
+from pytest_mock import MockerFixture
+
+from warmup import request_latency, warm_up
+
+
+def test_request_latency(mocker: MockerFixture):
+    urlopen_mock = mocker.patch("warmup.urlopen")
+    assert request_latency("http://localhost/") < 1
+    urlopen_mock.side_effect = HTTPError("http://localhost/", 403, "Forbidden", {}, None)
+    assert request_latency("http://localhost/") < 1
+    urlopen_mock.side_effect = URLError("refused")
+    assert request_latency("http://localhost/") == float("inf")
+
+
+def test_warm_up(mocker: MockerFixture):
+    mocker.patch("warmup.time.sleep")
+    latency_mock = mocker.patch("warmup.request_latency")
+    # Slow first rounds, then three fast rounds in a row
+    latencies = [float("inf"), 2.0, 0.1, 0.5, 0.1, 0.1, 0.1, 0.1]
+    latency_mock.side_effect = latencies
+    assert warm_up("http://localhost/guacamole", ["/"], 0.2, 60) is not None
+    assert latency_mock.call_count == 7
+    latency_mock.assert_called_with("http://localhost/guacamole/")
+    # The latency never settles
+    latency_mock.side_effect = None
+    latency_mock.return_value = 1.0
+    mocker.patch("warmup.time.monotonic", side_effect=[0, 1, 2, 30, 61])
+    assert warm_up("http://localhost/guacamole", ["/", "/api/languages"], 0.2, 60) is None